@@ -10,6 +10,10 @@ print('############## PURELY DATA-DRIVEN APPROACH ####\n')
 
 df_file_path = os.path.join(root_loc, 'Aug5-dataframes/data_driven/master_df_with_filtered_cols_50.0')
 master_df_with_filtered_cols = pd.read_pickle(df_file_path)
+# main.py stores compacted dtypes; the steps below compare values one at a time and expect
+# float64 columns with NaN for missing values
+from implementation_final import widen_compacted_dtypes
+master_df_with_filtered_cols = widen_compacted_dtypes(master_df_with_filtered_cols)
 
 # 5.1 "Clean up" dataframe
 # 5.1.1 Sort columns based on whether they are continuous, categorical, mixed or of object dtype
@@ -41,10 +45,13 @@ from implementation_final import mixed_cols_to_cat_cols
 master_df_with_filtered_cols = mixed_cols_to_cat_cols(master_df_with_filtered_cols, mixed_cols)
 cat_cols.extend(mixed_cols)
 
-# 5.1.1.2 Convert all categorical columns to contain string values
-from implementation_final import convert_cat_col_vals_to_str
+# 5.1.1.2 Convert all categorical columns to pandas Categorical - the vocabulary of each column is
+# kept in a json file so that the same category gets the same code when the data is prepared again
+from implementation_final import categorical_vocabularies, convert_cat_cols_to_categorical
 
-master_df_with_filtered_cols = convert_cat_col_vals_to_str(master_df_with_filtered_cols, cat_cols)
+cat_vocabularies = categorical_vocabularies(master_df_with_filtered_cols, cat_cols,\
+    os.path.join(root_loc, 'data_driven_with_lab_categorical_vocabularies.json'))
+master_df_with_filtered_cols = convert_cat_cols_to_categorical(master_df_with_filtered_cols, cat_cols, cat_vocabularies)
 
 # 5.1.2 Assign Diabetes Class Labels
 from implementation_final import assign_diabetes_class_labels
@@ -6,7 +6,11 @@ from implementation_final import baseline_cont_pipeline, baseline_cat_pipeline,\
     cont_pipeline1, cat_pipeline1, cont_pipeline2, cat_pipeline2,\
         cont_pipeline3, cat_pipeline3
 from sklearn.compose import ColumnTransformer 
-from _01_with_lab_data_driven_prep_for_ML import X, y, cont_cols, cat_cols
+from _01_with_lab_data_driven_prep_for_ML import X, y, cont_cols, cat_cols, cat_vocabularies
+from implementation_final import set_one_hot_categories
+
+# encode every category of the vocabularies, whether or not X holds it
+set_one_hot_categories([baseline_cat_pipeline, cat_pipeline1, cat_pipeline2, cat_pipeline3], cat_cols, cat_vocabularies)
 
 baseline_pipeline = ColumnTransformer([
     ('continuous', baseline_cont_pipeline, cont_cols),
@@ -3,7 +3,7 @@ import numpy as np
 
 # Use best RFC transformation pipeline and best XGB transformation pipeline to perform Grid Search
 from _02_without_lab_data_driven_test_pipelines import X, y, cont_cols, cat_cols, \
-    best_rfc_transformation_pipeline, best_xgb_transformation_pipeline
+    best_rfc_transformation_pipeline, best_xgb_transformation_pipeline, cat_vocabularies
 from sklearn.ensemble import RandomForestClassifier
 from xgboost import XGBClassifier
 from sklearn.model_selection import GridSearchCV, cross_val_predict
@@ -97,8 +97,10 @@ else:
     best_transformation_pipeline = best_rfc_transformation_pipeline
 
 # Feature Importance
-one_hot_columns = best_transformation_pipeline.named_transformers_['categorical'].\
-    named_steps['one_hot_encoder'].get_feature_names(input_features=cat_cols)
+from implementation_final import one_hot_feature_names
+
+one_hot_columns = one_hot_feature_names(best_transformation_pipeline.named_transformers_['categorical'].\
+    named_steps['one_hot_encoder'], cat_cols, cat_vocabularies)
 all_columns = cont_cols + list(one_hot_columns)
 top_feature_names = list(np.array(all_columns)[best_model.feature_importances_.argsort()[::-1]])
 top_feature_weights = list(np.array(best_model.feature_importances_)[best_model.feature_importances_.argsort()[::-1]])
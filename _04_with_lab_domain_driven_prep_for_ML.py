@@ -10,6 +10,10 @@ print('############## DOMAIN-DRIVEN APPROACH #########')
 
 df_file_path = os.path.join(root_loc, 'Aug5-dataframes/domain_driven/final_df')
 final_df = pd.read_pickle(df_file_path)
+# main.py stores compacted dtypes; the steps below compare values one at a time and expect
+# float64 columns with NaN for missing values
+from implementation_final import widen_compacted_dtypes
+final_df = widen_compacted_dtypes(final_df)
 
 # 6.1 Clean dataframe
 
@@ -20,7 +24,8 @@ xls = pd.ExcelFile(excel_path)
 relevant_cols_dom_df = pd.read_excel(xls, sheet_name='Sheet5')
 # Only keep relevant columns
 relevant_cols_dom_df.drop(relevant_cols_dom_df.columns[[0,1,3,4]], axis=1, inplace=True)
-relevant_cols_dom_df['Feature_Col_Name'] = list(map(lambda s: s.split('\'')[1], list(relevant_cols_dom_df['Feature_Col_Name'])))
+from implementation_final import decode_byte_strings
+relevant_cols_dom_df['Feature_Col_Name'] = decode_byte_strings(relevant_cols_dom_df['Feature_Col_Name'])
 all_relevant_cols_dom = list(relevant_cols_dom_df['Feature_Col_Name'])
 all_relevant_cols_dom.remove('BPQ090D') # isn't included in final_df
 final_df = final_df[all_relevant_cols_dom]
@@ -68,10 +73,13 @@ from implementation_final import mixed_cols_to_cat_cols
 engineered_df = mixed_cols_to_cat_cols(engineered_df, mixed_cols_dom)
 cat_cols_dom.extend(mixed_cols_dom)
 
-# 6.1.7 Convert all categorical columns to contain string values
-from implementation_final import convert_cat_col_vals_to_str
+# 6.1.7 Convert all categorical columns to pandas Categorical - the vocabulary of each column is
+# kept in a json file so that the same category gets the same code when the data is prepared again
+from implementation_final import categorical_vocabularies, convert_cat_cols_to_categorical
 
-engineered_df = convert_cat_col_vals_to_str(engineered_df, cat_cols_dom)
+cat_vocabularies = categorical_vocabularies(engineered_df, cat_cols_dom,\
+    os.path.join(root_loc, 'domain_driven_with_lab_categorical_vocabularies.json'))
+engineered_df = convert_cat_cols_to_categorical(engineered_df, cat_cols_dom, cat_vocabularies)
 
 # 6.1.8 Assign Diabetes Class Labels
 from implementation_final import assign_diabetes_class_labels
@@ -1,14 +1,355 @@
 import pandas as pd
 import numpy as np
 import os
+import re
+import json
+import struct
+import hashlib
+import inspect
 from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from pandas.core.arrays import categorical
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
 root_loc = os.path.abspath(".")
 
+# 0. Read NHANES data files (SAS XPORT version 5 format, .xpt) without going through pd.read_sas.
+#    Files are memory-mapped and only the columns that are needed get decoded, a whole
+#    column at a time
+def read_xpt_header(xpt_loc:str)->dict:
+    """Returns the layout of the dataset in an .xpt file using only its 80-byte
+    header records.
+
+    Args:
+        xpt_loc (str): location of .xpt file
+
+    Returns:
+        dict: dict with the dataset name, the columns (name, type, length and offset
+        of each variable within an observation), the length of one observation, 
+        where the observations start in the file and the number of observations.
+    """
+    with open(xpt_loc, 'rb') as f:
+        # Library header (3 records), member header (4 records), namestr header (1 record)
+        header = f.read(640)
+        assert header[:48] == b'HEADER RECORD*******LIBRARY HEADER RECORD!!!!!!!', \
+            "{} is not a SAS XPORT file".format(xpt_loc)
+        namestr_length = int(header[314:318])
+        dataset = header[408:416].decode('ascii').strip()
+        num_cols = int(header[614:618])
+        # Namestr records (one per variable) are padded to a multiple of 80 bytes
+        namestr_block_length = -(-num_cols * namestr_length // 80) * 80
+        namestr_block = f.read(namestr_block_length)
+        obs_header = f.read(80)
+        assert obs_header[:48] == b'HEADER RECORD*******OBS     HEADER RECORD!!!!!!!', \
+            "Unexpected header layout in {}".format(xpt_loc)
+        data_offset = f.tell()
+
+        columns = []
+        for i in range(num_cols):
+            namestr = namestr_block[i*namestr_length:(i+1)*namestr_length]
+            ntype, _, nlng, _, nname = struct.unpack('>hhhh8s', namestr[:16])
+            npos = struct.unpack('>l', namestr[84:88])[0]
+            columns.append({'name': nname.decode('ascii').strip(),\
+                'type': 'numeric' if ntype == 1 else 'char', 'length': nlng, 'offset': npos})
+        obs_length = sum([column['length'] for column in columns])
+
+        # The last 80-byte record is padded with blanks after the final observation
+        data_length = os.path.getsize(xpt_loc) - data_offset
+        num_rows = data_length // obs_length if obs_length > 0 else 0
+        if (obs_length > 0) and (obs_length < 80) and (data_length >= 80):
+            f.seek(-80, 2)
+            last_record = np.frombuffer(f.read(80), dtype=np.uint64)
+            tail_padding = 8 * np.count_nonzero(last_record == np.frombuffer(b' '*8, dtype=np.uint64)[0])
+            num_rows = (data_length - tail_padding) // obs_length
+
+    return {'dataset': dataset, 'columns': columns, 'obs_length': obs_length,\
+        'data_offset': data_offset, 'num_rows': int(num_rows)}
+
+def ibm_to_float64(raw:np.ndarray)->np.ndarray:
+    """Returns the float64 values of IBM-360 floating point numbers, as stored in 
+    the numeric columns of .xpt files. SAS missing values (., .A-.Z, ._) become NaN.
+
+    Args:
+        raw (np.ndarray): (number of rows, field length) array of uint8 bytes 
+
+    Returns:
+        np.ndarray: array of float64 values
+    """
+    # Numeric fields shorter than 8 bytes are truncated on the right
+    if raw.shape[1] < 8:
+        raw = np.concatenate([raw, np.zeros((raw.shape[0], 8 - raw.shape[1]), dtype=np.uint8)], axis=1)
+    words = np.ascontiguousarray(raw).view('>u4').reshape(-1, 2)
+    xport1 = words[:, 0].astype(np.uint32)
+    xport2 = words[:, 1].astype(np.uint32)
+    # Shift the fraction so the leading bit lands left of the binary point, then
+    # rebuild the exponent as a power of 2 (IBM exponent is a power of 16, excess 64)
+    shift = np.zeros(len(xport1), dtype=np.uint32)
+    shift[(xport1 & 0x00200000) != 0] = 1
+    shift[(xport1 & 0x00400000) != 0] = 2
+    shift[(xport1 & 0x00800000) != 0] = 3
+    ieee1 = (xport1 & 0x00FFFFFF) >> shift
+    ieee2 = (xport2 >> shift) | ((xport1 & 0x00000007) << (29 + (3 - shift)))
+    ieee1 &= 0xFFEFFFFF
+    exponent = ((((xport1 >> 24) & 0x7F).astype(np.int64) - 65) << 2) + shift + 1023
+    ieee1 |= (exponent.astype(np.uint32) << 20) | (xport1 & 0x80000000)
+    ieee = np.empty((len(ieee1), 2), dtype='>u4')
+    ieee[:, 0] = ieee1
+    ieee[:, 1] = ieee2
+    values = ieee.view('>f8').reshape(-1).astype(np.float64)
+    # IBM zero has no leading fraction bit
+    values[(xport1 & 0x00FFFFFF == 0) & (xport2 == 0)] = 0.0
+    # Missing values: first byte is '.', 'A'-'Z' or '_' and the rest is zero
+    first_byte = raw[:, 0]
+    missing = ((first_byte == 0x2E) | (first_byte == 0x5F) | ((first_byte >= 0x41) & (first_byte <= 0x5A))) \
+        & ~raw[:, 1:].any(axis=1)
+    values[missing] = np.nan
+    return values
+
+def column_is_selected(column:str, columns=None)->bool:
+    """Returns True if a column is part of a column projection.
+
+    Args:
+        column (str): column name
+        columns (list or callable, optional): list of column names to keep, or a function
+        taking a column name and returning True if the column should be kept. Defaults 
+        to None (keep every column).
+
+    Returns:
+        bool: True if the column should be kept
+    """
+    if columns is None:
+        return True
+    if callable(columns):
+        return bool(columns(column))
+    return column in columns
+
+def xpt_records_to_df(records:np.ndarray, xpt_columns:list)->pd.DataFrame:
+    """Returns a dataframe from the raw observations of an .xpt file. Numeric columns 
+    become float64 and character columns become bytes with trailing blanks removed,
+    like pd.read_sas.
+
+    Args:
+        records (np.ndarray): (number of rows, observation length) array of uint8 bytes
+        xpt_columns (list): columns (from read_xpt_header) to decode
+
+    Returns:
+        pd.DataFrame: dataframe with one column per decoded column
+    """
+    df = {}
+    for col in xpt_columns:
+        raw = records[:, col['offset']:col['offset'] + col['length']]
+        if col['type'] == 'numeric':
+            df[col['name']] = ibm_to_float64(raw)
+        else:
+            fixed_width = np.ascontiguousarray(raw).view('S{}'.format(col['length'])).reshape(-1)
+            df[col['name']] = np.char.rstrip(fixed_width, b' ').astype(object)
+    return pd.DataFrame(df, index=pd.RangeIndex(len(records)))
+
+def xpt_records(xpt_loc:str, header:dict=None)->np.ndarray:
+    """Returns the observations of an .xpt file as a memory-mapped array, without 
+    reading or copying the file.
+
+    Args:
+        xpt_loc (str): location of .xpt file
+        header (dict, optional): layout of the file from read_xpt_header. Defaults to None
+        (read the header).
+
+    Returns:
+        np.ndarray: (number of rows, observation length) array of uint8 bytes
+    """
+    if header is None:
+        header = read_xpt_header(xpt_loc)
+    if (header['num_rows'] == 0) or (header['obs_length'] == 0):
+        return np.zeros((0, header['obs_length']), dtype=np.uint8)
+    return np.memmap(xpt_loc, dtype=np.uint8, mode='r', offset=header['data_offset'],\
+        shape=(header['num_rows'], header['obs_length']))
+
+def read_xpt(xpt_loc:str, columns=None)->pd.DataFrame:
+    """Returns the dataframe of an .xpt file where only the projected columns are decoded.
+
+    Args:
+        xpt_loc (str): location of .xpt file
+        columns (list or callable, optional): list of column names to keep, or a function
+        taking a column name and returning True if the column should be kept. Defaults 
+        to None (every column).
+
+    Returns:
+        pd.DataFrame: dataframe of the .xpt file with only the projected columns
+    """
+    header = read_xpt_header(xpt_loc)
+    xpt_columns = [col for col in header['columns'] if column_is_selected(col['name'], columns)]
+    return xpt_records_to_df(xpt_records(xpt_loc, header), xpt_columns)
+
+def iter_xpt_chunks(xpt_loc:str, columns=None, chunksize:int=10000):
+    """Yields the dataframe of an .xpt file chunksize rows at a time, decoding only
+    the projected columns. 
+
+    Args:
+        xpt_loc (str): location of .xpt file
+        columns (list or callable, optional): list of column names to keep, or a function
+        taking a column name and returning True if the column should be kept. Defaults 
+        to None (every column).
+        chunksize (int, optional): number of rows per chunk. Defaults to 10000.
+
+    Yields:
+        pd.DataFrame: dataframe of the next chunksize rows, indexed by row number in the file
+    """
+    header = read_xpt_header(xpt_loc)
+    xpt_columns = [col for col in header['columns'] if column_is_selected(col['name'], columns)]
+    records = xpt_records(xpt_loc, header)
+    for start in range(0, len(records), chunksize):
+        chunk = xpt_records_to_df(records[start:start + chunksize], xpt_columns)
+        chunk.index = chunk.index + start
+        yield chunk
+
+def iter_xpt_column_chunks(xpt_loc:str, column:str, chunksize:int=10000):
+    """Yields the values of a single numeric column of an .xpt file, chunksize rows
+    at a time. Only the bytes of that column are decoded.
+
+    Args:
+        xpt_loc (str): location of .xpt file
+        column (str): name of numeric column e.g. 'SEQN'
+        chunksize (int, optional): number of rows per chunk. Defaults to 10000.
+
+    Yields:
+        np.ndarray: float64 values of the column for the next chunksize rows
+    """
+    header = read_xpt_header(xpt_loc)
+    col = [c for c in header['columns'] if c['name'] == column][0]
+    records = xpt_records(xpt_loc, header)
+    for start in range(0, len(records), chunksize):
+        yield ibm_to_float64(records[start:start + chunksize, col['offset']:col['offset'] + col['length']])
+
+def decode_byte_strings(values:pd.Series, encoding:str='latin-1')->pd.Series:
+    """Returns the strings of a column of SAS character values (byte strings), decoded for
+    the whole column at once. Byte strings that were written out as text, e.g. "b'LBXGLU'" 
+    in the Excel sheets, are decoded the same way. Empty strings become NaN.
+
+    Args:
+        values (pd.Series): column of byte strings, or of their text representations
+        encoding (str, optional): encoding of the byte strings. Defaults to 'latin-1'.
+
+    Returns:
+        pd.Series: column of strings, NaN where the value was empty or missing
+    """
+    inferred_type = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred_type == 'bytes':
+        strings = values.str.decode(encoding)
+    elif inferred_type == 'string':
+        strings = values.str.replace(r"""^b(['"])(.*)\1$""", r'\2', regex=True)
+    else:
+        # Only missing values
+        return pd.Series(np.nan, index=values.index, dtype=object)
+    return strings.mask(strings == '')
+
+def file_signature(file_loc:str)->list:
+    """Returns the size and last modification time of a file, used to tell whether
+    it changed since it was last processed.
+
+    Args:
+        file_loc (str): location of file
+
+    Returns:
+        list: [size in bytes, modification time in ns]
+    """
+    stat = os.stat(file_loc)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# 0.1 Columnar cache of .xpt files: each column is decoded once and stored in an uncompressed
+#     Feather file (memory-mapped when read back), named after the file's content hash
+xpt_cache_dir = os.path.join(root_loc, 'xpt_cache')
+# Version of the decoded values, part of every cache file name: increase it when read_xpt decodes
+# values differently so that files cached before are not reused (2: native reader, IBM zero is 0.0
+# where pd.read_sas gave 5.4e-79)
+xpt_cache_version = 2
+
+def file_content_hash(file_loc:str)->str:
+    """Returns the SHA-1 hash of the contents of a file. Hashes are remembered
+    per (path, size, mtime) in the cache directory so unchanged files are only read once.
+    Every file has its own small index file, so processes hashing different files at the
+    same time never overwrite each other's entries.
+
+    Args:
+        file_loc (str): location of file
+
+    Returns:
+        str: hex digest of the file contents
+    """
+    index_dir = os.path.join(xpt_cache_dir, 'content_hashes')
+    index_path = os.path.join(index_dir, hashlib.sha1(str(file_loc).encode()).hexdigest() + '.json')
+    signature = file_signature(file_loc)
+    if os.path.isfile(index_path):
+        with open(index_path, 'r') as f:
+            entry = json.load(f)
+        if entry['signature'] == signature:
+            return entry['hash']
+
+    sha1 = hashlib.sha1()
+    with open(file_loc, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            sha1.update(block)
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'path': str(file_loc), 'signature': signature, 'hash': sha1.hexdigest()}, f)
+    os.replace(tmp_path, index_path)
+    return sha1.hexdigest()
+
+def read_xpt_cached(xpt_loc:str, columns=None)->pd.DataFrame:
+    """Returns the dataframe of an .xpt file with only the projected columns. Only the 
+    projected columns that are not in the columnar cache yet are decoded; they are then 
+    added to the cache, so every column of a file is decoded at most once.
+
+    Args:
+        xpt_loc (str): location of .xpt file
+        columns (list or callable, optional): list of column names to keep, or a function
+        taking a column name and returning True if the column should be kept. Defaults 
+        to None (every column).
+
+    Returns:
+        pd.DataFrame: dataframe of the .xpt file with only the projected columns
+    """
+    xpt_cols = [col['name'] for col in read_xpt_header(xpt_loc)['columns']]
+    projected_cols = [col for col in xpt_cols if column_is_selected(col, columns)]
+    cache_name = '{}_v{}'.format(file_content_hash(xpt_loc), xpt_cache_version)
+    cached_df = None
+    if feather is not None:
+        cache_loc = os.path.join(xpt_cache_dir, cache_name + '.feather')
+        if os.path.isfile(cache_loc):
+            table = feather.read_table(cache_loc, memory_map=True)
+            if set(projected_cols).issubset(table.column_names):
+                return table.select(projected_cols).to_pandas()
+            cached_df = table.to_pandas()
+    else:
+        # pyarrow is not installed: fall back to pickle files
+        cache_loc = os.path.join(xpt_cache_dir, cache_name + '.pkl')
+        if os.path.isfile(cache_loc):
+            cached_df = pd.read_pickle(cache_loc)
+            if set(projected_cols).issubset(cached_df.columns):
+                return cached_df[projected_cols]
+
+    cached_cols = [] if cached_df is None else list(cached_df.columns)
+    df = read_xpt(xpt_loc, columns=[col for col in projected_cols if col not in cached_cols])
+    if cached_df is not None:
+        df = pd.concat([cached_df, df], axis=1)
+    df = df[[col for col in xpt_cols if col in df.columns]]
+    os.makedirs(xpt_cache_dir, exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(cache_loc, os.getpid())
+    if feather is not None:
+        feather.write_feather(df, tmp_path, compression='uncompressed')
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_loc)
+    return df[projected_cols]
+
 # 1. Merge data for one year bracket using only data files that contain unique patients (SEQN)
 def locate_xpt_files(loc:str)->list:
     """Takes the location of a folder and returns a list of .xpt files located anywhere
-    within this folder and its subfolders.
+    within this folder and its subfolders. Folders inside the NHANES data folder are
+    looked up in the XPT catalog instead of being walked again.
 
     Args:
         loc (str): location of folder
@@ -18,6 +359,11 @@ def locate_xpt_files(loc:str)->list:
     """
     assert os.path.isdir(loc), "This function needs a valid direct, you \
         specified {}, check".format(loc)   
+    loc = os.path.abspath(loc)
+    if (loc + os.sep).startswith(os.path.join(nhanes_data_loc, '')):
+        catalog = xpt_catalog()
+        folder_prefix = os.path.join(loc, '')
+        return [Path(path) for path in catalog['path'] if path.startswith(folder_prefix)]
     flist = list(Path(loc).rglob("*.[xX][pP][tT]"))
     return flist
 
@@ -32,6 +378,131 @@ def array_unique(X:np.array)->bool:
     """
     return len(np.unique(X)) == len(X)
 
+def xpt_file_has_repeated_seqn(xpt_loc:str)->bool:
+    """Returns True if the .xpt file has a SEQN column with repeating values. Only the
+    SEQN column is decoded and SEQN seen in earlier chunks are remembered, so repeats 
+    spanning two chunks are also found.
+
+    Args:
+        xpt_loc (str): location of .xpt file
+
+    Returns:
+        bool: True if SEQN repeats in the file and False otherwise
+    """
+    print("Processing: {}".format(str(xpt_loc)))
+    # Check if SEQN exists
+    if 'SEQN' not in [column['name'] for column in read_xpt_header(xpt_loc)['columns']]:
+        return False # If no, move on
+
+    # Load 10000 SEQN to check for duplicates at a time
+    seen_seqn = set()
+    for chunk in iter_xpt_column_chunks(xpt_loc, 'SEQN', chunksize=10000):
+        num_seen = len(seen_seqn)
+        seen_seqn.update(chunk.astype(np.int64).tolist())
+        if len(seen_seqn) - num_seen != len(chunk):
+            return True
+    return False
+
+# 1.1 Catalog of every .xpt file in the NHANES data folder, built from the file headers
+#     and refreshed only for files whose size or modification time changed
+nhanes_data_loc = os.path.join(root_loc, 'diabetes/NHANES data')
+xpt_catalog_path = os.path.join(root_loc, 'xpt_catalog.pkl')
+xpt_catalog_cols = ['year', 'root_cat', 'dataset', 'path', 'size', 'mtime', 'num_rows',\
+    'variables', 'variable_types', 'seqn_unique']
+# Catalogs already loaded by this process, keyed by catalog path
+loaded_xpt_catalogs = {}
+
+def xpt_catalog_entry(xpt_loc:str, data_loc:str=nhanes_data_loc)->dict:
+    """Returns the catalog entry of an .xpt file. Only the header and the SEQN column
+    of the file are read.
+
+    Args:
+        xpt_loc (str): location of .xpt file
+        data_loc (str, optional): location of the NHANES data folder, which contains 
+        one 'NHANES <year>' folder per year bracket. 
+
+    Returns:
+        dict: year bracket, root category, dataset name, path, size, modification time, 
+        number of rows, variable names and types of the file, and whether its SEQN are 
+        unique (None if it has no SEQN column)
+    """
+    header = read_xpt_header(xpt_loc)
+    size, mtime = file_signature(xpt_loc)
+    folders = Path(os.path.relpath(xpt_loc, data_loc)).parts
+    year = folders[0].replace('NHANES ', '') if len(folders) > 2 else None
+    root_cat = folders[1] if len(folders) > 2 else None
+    variables = tuple([col['name'] for col in header['columns']])
+    seqn_unique = (not xpt_file_has_repeated_seqn(xpt_loc)) if ('SEQN' in variables) else None
+    return {'year': year, 'root_cat': root_cat, 'dataset': header['dataset'], 'path': str(xpt_loc),\
+        'size': size, 'mtime': mtime, 'num_rows': header['num_rows'], 'variables': variables,\
+        'variable_types': tuple([col['type'] for col in header['columns']]), 'seqn_unique': seqn_unique}
+
+def refresh_xpt_catalog(data_loc:str=nhanes_data_loc, catalog_path:str=xpt_catalog_path,\
+    max_workers:int=None)->pd.DataFrame:
+    """Returns the catalog of .xpt files after bringing it up to date with the data folder,
+    which is walked once. Only new or changed files are read again, in a pool of processes.
+
+    Args:
+        data_loc (str, optional): location of the NHANES data folder.
+        catalog_path (str, optional): location of the persisted catalog. Defaults to 'xpt_catalog.pkl'.
+        max_workers (int, optional): number of processes to use, 1 to read the files in this
+        process. Defaults to None (all cores).
+
+    Returns:
+        pd.DataFrame: catalog with one row per .xpt file, sorted by path
+    """
+    if os.path.isfile(catalog_path):
+        old_catalog = pd.read_pickle(catalog_path)
+    else:
+        old_catalog = pd.DataFrame(columns=xpt_catalog_cols)
+    old_entries = {entry['path']: entry for entry in old_catalog.to_dict('records')}
+
+    xpt_list = sorted([str(xpt_loc) for xpt_loc in Path(data_loc).rglob("*.[xX][pP][tT]")])
+    entries = {}
+    stale_files = []
+    for xpt_loc in xpt_list:
+        old_entry = old_entries.get(xpt_loc)
+        if (old_entry is not None) and ([old_entry['size'], old_entry['mtime']] == file_signature(xpt_loc)):
+            entries[xpt_loc] = old_entry
+        else:
+            stale_files.append(xpt_loc)
+
+    if stale_files and (max_workers == 1):
+        new_entries = [xpt_catalog_entry(xpt_loc, data_loc) for xpt_loc in stale_files]
+    elif stale_files:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            new_entries = list(executor.map(xpt_catalog_entry, stale_files,\
+                [data_loc]*len(stale_files), chunksize=4))
+    if stale_files:
+        for entry in new_entries:
+            entries[entry['path']] = entry
+
+    catalog = pd.DataFrame([entries[xpt_loc] for xpt_loc in xpt_list], columns=xpt_catalog_cols)
+    if stale_files or (len(catalog) != len(old_catalog)):
+        tmp_path = '{}.{}.tmp'.format(catalog_path, os.getpid())
+        catalog.to_pickle(tmp_path)
+        os.replace(tmp_path, catalog_path)
+    loaded_xpt_catalogs[catalog_path] = catalog
+    return catalog
+
+def xpt_catalog(data_loc:str=nhanes_data_loc, catalog_path:str=xpt_catalog_path)->pd.DataFrame:
+    """Returns the catalog of .xpt files. The first time a process asks for the catalog it is
+    brought up to date with the data folder (see refresh_xpt_catalog), so files that were 
+    added or changed since it was persisted are never missed; afterwards it is served from 
+    memory. New or changed files are read without a process pool since this can happen 
+    while the module is being imported.
+
+    Args:
+        data_loc (str, optional): location of the NHANES data folder.
+        catalog_path (str, optional): location of the persisted catalog. Defaults to 'xpt_catalog.pkl'.
+
+    Returns:
+        pd.DataFrame: catalog with one row per .xpt file, sorted by path
+    """
+    if catalog_path not in loaded_xpt_catalogs:
+        refresh_xpt_catalog(data_loc, catalog_path, max_workers=1)
+    return loaded_xpt_catalogs[catalog_path]
+
 def locate_files_with_repeated_seqn(years:list, root_cat:str)->list:
     """Returns a list of filenames with repeating SEQN.
 
@@ -42,37 +513,38 @@ def locate_files_with_repeated_seqn(years:list, root_cat:str)->list:
     Returns:
         list: list of filenames
     """
+    catalog = xpt_catalog()
     files_with_repeated_seqn = []
-
     for year in years:
-        data_dir = os.path.join(root_loc, 'diabetes/NHANES data', 'NHANES '+year, root_cat)
-        # Get a list of XPT files from data_dir
-        xpt_list = locate_xpt_files(data_dir)
-        # All unique SEQN in given year
+        year_files = catalog[(catalog['year'] == year) & (catalog['root_cat'] == root_cat)]
+        files_with_repeated_seqn.extend(list(year_files[year_files['seqn_unique'] == False]['path']))
+    return files_with_repeated_seqn
 
-        for xpt_loc in xpt_list:
-            # Get list of SEQN in xpt_list
-            print("Processing: {}".format(str(xpt_loc)))
-
-            # Get file size
-            # if file size > 100 MB
-            # Load 10000 rows to check for duplicates at a time
-            sas_rdr_obj = pd.read_sas(xpt_loc, chunksize=10000, iterator=True)
-
-            for chunk in sas_rdr_obj:
-                # Check if SEQN exists
-                if 'SEQN' in chunk.columns:
-                    # If yes, see if SEQN Unique
-                    if not array_unique( np.array(list(chunk['SEQN']),dtype=np.int32) ):
-                        files_with_repeated_seqn.append(str(xpt_loc))
-                        break
-                else:
-                    break # If no, move on
+def locate_files_with_repeated_seqn_in_parallel(years:list, root_cats:list,\
+    max_workers:int=None)->list:
+    """Returns a list of filenames with repeating SEQN across all year brackets and
+    root categories. The XPT catalog is refreshed first: every new or changed .xpt file
+    is checked independently in a pool of processes, and unchanged files are looked up.
+
+    Args:
+        years (list): list of year brackets e.g. ['1999-2000','2001-2002',...]
+        root_cats (list): list of root categories e.g. ['Demographic data', 'Dietary data'...]
+        max_workers (int, optional): number of processes to use. Defaults to None (all cores).
+
+    Returns:
+        list: list of filenames, in the same order as locate_files_with_repeated_seqn
+        would return them one root category at a time
+    """
+    refresh_xpt_catalog(max_workers=max_workers)
+    files_with_repeated_seqn = []
+    for root_cat in root_cats:
+        files_with_repeated_seqn.extend(locate_files_with_repeated_seqn(years, root_cat))
     return files_with_repeated_seqn
 
 def combine_cols_with_same_names_while_merging(df:pd.DataFrame)->pd.DataFrame:
     """Returns a df where all columns with the same prefix but different suffixes get
-    combined into one.
+    combined into one. Columns are grouped by their name without the _x, _y suffixes,
+    so three or more colliding columns are combined too, and the whole df is rebuilt once.
 
     Args:
         df (pd.DataFrame): dataframe containing repeating columns with the same prefix
@@ -81,56 +553,90 @@ def combine_cols_with_same_names_while_merging(df:pd.DataFrame)->pd.DataFrame:
     Returns:
         pd.DataFrame: dataframe where each column is unique
     """
-    # Get column names of cols with _x, _y suffix
-    cols_with_suffixes = [col for col in list(df.columns) if ('_x' in col or '_y' in col)]
-    # Sort column names
-    cols_with_suffixes.sort()
-
-    new_df = df
-    i = 0
-    while i < len(cols_with_suffixes):
-        # Get pair of columns: col_a and col_b
-        col_a = cols_with_suffixes[i]
-        col_b = cols_with_suffixes[i+1]
-        # Locate rows in col_a that are null, but not_null in col_b
-        rows_of_interest = ((df[col_a].isnull())) & (~(df[col_b].isnull()))
-        # Overwrite these rows in col_a with values from col_b
-        new_df[col_a][rows_of_interest] = new_df[col_b][rows_of_interest]
-        new_df = new_df.drop(columns=[col_b])
-        new_df = new_df.rename(columns={col_a: col_a[:-2]})
-        i += 2
-    return new_df
-
-def merge_data_for_one_year_bracket(root_cats:list, year:str, skip_files=None)->pd.DataFrame:
+    # Name of each column without the _x, _y suffixes added while merging
+    base_names = [re.sub(r'(_x|_y)+$', '', col) for col in df.columns]
+    num_cols_with_base_name = pd.Series(base_names).value_counts()
+    # Only rename columns that actually collide with another column
+    new_names = [base_name if num_cols_with_base_name[base_name] > 1 else col\
+        for col, base_name in zip(df.columns, base_names)]
+    if new_names == list(df.columns):
+        return df
+    new_df = df.set_axis(new_names, axis=1)
+    # Earlier (left) columns take priority over later (right) ones
+    return coalesce_cols_with_same_names(new_df)
+
+def coalesce_cols_with_same_names(df:pd.DataFrame)->pd.DataFrame:
+    """Returns a df where all columns with the same name get combined into one. 
+    The first non-null value from left to right is kept, so earlier columns take
+    priority like in combine_cols_with_same_names_while_merging.
+
+    Args:
+        df (pd.DataFrame): dataframe that may contain several columns with the same name.
+
+    Returns:
+        pd.DataFrame: dataframe where each column is unique
+    """
+    if df.columns.is_unique:
+        return df
+    # Positions of the columns with each name, in order of first occurrence
+    col_positions = {}
+    for position, col in enumerate(df.columns):
+        col_positions.setdefault(col, []).append(position)
+
+    columns = {}
+    for col, positions in col_positions.items():
+        if len(positions) == 1:
+            columns[col] = df.iloc[:, positions[0]]
+        else:
+            columns[col] = df.iloc[:, positions].bfill(axis=1).iloc[:, 0]
+    return pd.DataFrame(columns, index=df.index)
+
+def merge_data_for_one_year_bracket(root_cats:list, year:str, skip_files=None, columns=None,\
+    seqns=None)->pd.DataFrame:
     """Returns a dataframe containing data for one year bracket while only 
-    including patients from files that don't have repeated patients.
+    including patients from files that don't have repeated patients. All files
+    are aligned on SEQN at once instead of being merged one after the other.
 
     Args:
         root_cats (list): list of root categories e.g. ['Demographic data', 'Dietary data'...]
         year (str): year bracket e.g. '1999-2000', '2001-2002', ..., '2017-2018'
         skip_files ([list], optional): list of file names to skip over. Defaults to None.
+        columns (list or callable, optional): list of column names to keep, or a function
+        taking a column name and returning True if the column should be kept. Only these
+        columns are read from the files; SEQN is always kept. Defaults to None (every column).
+        seqns (list-like, optional): SEQN to keep, e.g. the patients eligible for the cohort.
+        Defaults to None (every SEQN).
 
     Returns:
         [pd.DataFrame]: dataframe for one year bracket
     """
-    # Empty Df for year to store all data
-    year_df = pd.DataFrame({'SEQN': []})
+    if skip_files is None:
+        skip_files = []
+    seqn_and_columns = lambda col: (col == 'SEQN') or column_is_selected(col, columns)
+    # Data of every file for the year, indexed by SEQN
+    dfs_for_year = []
     for root_cat in root_cats:
         data_dir = os.path.join(root_loc, 'diabetes/NHANES data', 'NHANES '+year, root_cat)
-        # Empty Df for root_cat to store all data
-        root_cat_df = pd.DataFrame({'SEQN': []})
         # Get a list of XPT files from data_dir
         xpt_list = locate_xpt_files(data_dir)
         for xpt_loc in xpt_list:
             if str(xpt_loc) in skip_files:
                 continue
-            temp_df = pd.read_sas(xpt_loc) # Load data
+            temp_df = read_xpt_cached(xpt_loc, columns=seqn_and_columns) # Load data
             if ('SEQN' in temp_df.columns):
-                root_cat_df = root_cat_df.merge(temp_df, on='SEQN', how='outer', sort=True)
-                root_cat_df = combine_cols_with_same_names_while_merging(root_cat_df)
+                if seqns is not None:
+                    temp_df = temp_df[temp_df['SEQN'].isin(seqns)]
+                dfs_for_year.append(temp_df.set_index('SEQN'))
         print('There is a dataframe of {} from {}'.format(root_cat, year))
-        year_df = year_df.merge(root_cat_df, on='SEQN', how='outer', sort=True)
-        year_df = combine_cols_with_same_names_while_merging(year_df)
+
+    if dfs_for_year == []:
+        return pd.DataFrame({'SEQN': []})
+    # Outer join of all files on SEQN in one pass, then combine the columns that appear
+    # in more than one file
+    year_df = pd.concat(dfs_for_year, axis=1, join='outer', sort=True)
+    year_df = coalesce_cols_with_same_names(year_df)
+    year_df.index.name = 'SEQN'
+    year_df = year_df.reset_index()
     print('There is a dataframe from {}'.format(year))
     return year_df
 
@@ -138,511 +644,489 @@ def merge_data_for_one_year_bracket(root_cats:list, year:str, skip_files=None)->
 #    with repeated patients
 
 # 2.1 Prescription Medication: Create dataframes for each year bracket
-def drugs_used_by_SEQN(df:pd.DataFrame, seqn:int)->list:
-    """Returns a list of the Generic Drugs Codes of the drugs used by SEQN from df.
+# Drug Classes and the category codes of the drugs they contain. A category is either a first 
+# level category code or a tuple of category codes of successive levels (first, second, ...),
+# e.g. (358, 99) is the second level category 99 of the first level category 358. A drug falls 
+# under the Drug Class of its most specific category; between categories of the same level, 
+# the first Drug Class listed wins
+drug_class_names = {'AntiInfectives': [1], 'Cardiovascular_Coag_Agents': [40, 81],\
+    'Other_System_Agents': [57, 242, 87, 113, 122],\
+    'Hormones_Modifiers': [97], 'Immunomodulators': [20, 254], 'Antihyperlipidemic_Agents': [(358, 19)],\
+        'AntiDiabetic_Agents': [(358, 99)], 'Others': [133, 28, 105, 153, 218, 331, 115, 358]}
+
+def drug_class_lookup(drug_info_df:pd.DataFrame, class_names:dict=None)->pd.Series:
+    """Returns the Drug Class of every drug code of the Drug Information file, compiled once
+    from the category codes of the drugs so that it can be applied to all prescriptions at once.
 
     Args:
-        df (pd.DataFrame): DataFrame of Prescription Medications file
-        seqn (int): patient SEQN number
+        drug_info_df (pd.DataFrame): File containing Drug Information for a year bracket.
+        class_names (dict, optional): Drug Classes and their category codes. Defaults to
+        None (drug_class_names).
 
     Returns:
-        list: List of generic drug codes taken by each SEQN
+        pd.Series: Drug Class indexed by drug code (drugs in none of the classes are left out)
     """
-    df_with_only_seqn = df[df['SEQN'] == seqn]
-    drug_codes = list(df_with_only_seqn['RXDDRGID'])
-    drug_codes_edited = [drug_code for drug_code in drug_codes if drug_code != '']
-    return drug_codes_edited
-
-drug_class_names = {'AntiInfectives': [1], 'Cardiovascular_Coag_Agents': [40, 81],\
-    'Other_System_Agents': [57, 242, 87, 113, 122],\
-    'Hormones_Modifiers': [97], 'Immunomodulators': [20, 254], 'Antihyperlipidemic_Agents': [358],\
-        'AntiDiabetic_Agents': [358], 'Others': [133, 28, 105, 153, 218, 331, 115, 358]}
-
-def drug_code_to_dummy_col(drug_code:str, drug_info_df:pd.DataFrame)->str:
-    """Returns the dummy column that a drug code will fall under.
+    if class_names is None:
+        class_names = drug_class_names
+    rules = []
+    for drug_class in class_names:
+        for cat_codes in class_names[drug_class]:
+            cat_codes = tuple(cat_codes) if isinstance(cat_codes, (list, tuple)) else (cat_codes,)
+            rules.append(cat_codes + (drug_class,))
+    max_depth = max([len(rule) - 1 for rule in rules])
+    # Category codes of successive levels start at the 4th column of the Drug Information file
+    level_cols = list(drug_info_df.columns[3:3 + max_depth])
+    drugs_df = drug_info_df.drop_duplicates('RXDDRGID').set_index('RXDDRGID')[level_cols]
+
+    lookup = pd.Series(np.nan, index=drugs_df.index, dtype=object)
+    # The most specific categories are matched first
+    for depth in range(max_depth, 0, -1):
+        depth_rules = pd.DataFrame([rule for rule in rules if len(rule) == depth + 1],\
+            columns=level_cols[:depth] + ['Drug_Class'])
+        if len(depth_rules) == 0:
+            continue
+        depth_rules = depth_rules.drop_duplicates(level_cols[:depth])
+        matched = drugs_df[level_cols[:depth]].reset_index().merge(depth_rules, on=level_cols[:depth],\
+            how='inner').set_index('RXDDRGID')['Drug_Class']
+        lookup = lookup.fillna(matched)
+    return lookup.dropna()
+
+def pres_meds_with_drug_classes(data_df:pd.DataFrame, drug_info_df:pd.DataFrame,\
+    class_names:dict=None)->pd.DataFrame:
+    """Returns the rows of the Prescription Medications file that have a drug code, with
+    the Drug Class of the drug looked up from the compiled drug code -> Drug Class table.
 
     Args:
-        drug_code (str): Generic drug code of drug consumed by a SEQN.
+        data_df (pd.DataFrame): DataFrame of Prescription Medications file
         drug_info_df (pd.DataFrame): File containing Drug Information for a year bracket.
+        class_names (dict, optional): Drug Classes and their category codes.
+        Defaults to None (drug_class_names).
 
     Returns:
-        str: Dummy column representing a collection of drugs.
+        pd.DataFrame: SEQN, drug code, number of prescription meds, number of days taken
+        and Drug Class of each drug
     """
-    drug_code_row = drug_info_df[drug_info_df['RXDDRGID'] == drug_code]
+    # The columns were renamed in later year brackets
+    med_count_col = 'RXD295' if 'RXD295' in data_df.columns else 'RXDCOUNT'
+    days_taken_col = 'RXD260' if 'RXD260' in data_df.columns else 'RXDDAYS'
+    meds_df = data_df.loc[data_df['RXDDRGID'].notnull(), ['SEQN', 'RXDDRGID', med_count_col, days_taken_col]]
+    meds_df.columns = ['SEQN', 'RXDDRGID', 'Med_Count', 'Days_Taken']
+    if class_names is None:
+        class_names = drug_class_names
+    lookup = drug_class_lookup(drug_info_df, class_names)
+    meds_df['Drug_Class'] = pd.Categorical(meds_df['RXDDRGID'].map(lookup), categories=list(class_names))
+    return meds_df
+
+def num_drugs_in_drug_classes(meds_df:pd.DataFrame, class_names:list)->pd.DataFrame:
+    """Returns the number of drugs each SEQN takes in each Drug Class.
 
-    first_level_cat_code = drug_code_row.iloc[0][3]
-    second_level_cat_code =  drug_code_row.iloc[0][4]
+    Args:
+        meds_df (pd.DataFrame): Prescription Medications with Drug Classes
+        class_names (list): Drug Classes (dummy columns)
 
-    for drug_class in drug_class_names:
-        list_first_level_cats = drug_class_names[drug_class]
-        if first_level_cat_code == 358:
-            if second_level_cat_code == 19:
-                return 'Antihyperlipidemic_Agents' 
-            elif second_level_cat_code == 99:
-                return 'AntiDiabetic_Agents' 
-            else:
-                return 'Others'
-        else:
-            if first_level_cat_code in list_first_level_cats:
-                return drug_class
+    Returns:
+        pd.DataFrame: number of drugs in each Drug Class, indexed by SEQN
+    """
+    counts = meds_df.groupby(['SEQN', 'Drug_Class'], observed=True).size().unstack(fill_value=0)
+    return counts.reindex(index=pd.Index(meds_df['SEQN'].unique()).sort_values(), columns=class_names,\
+        fill_value=0)
 
-def dict_dummy_cols_for_seqn(dict_drugs_seqn:dict, drug_info_df:pd.DataFrame)->dict:
-    """Returns a dict where the keys are SEQN numbers and the values are lists of
-    Drug Classes that the SEQN meds fall under.
+def num_days_drug_classes_taken(meds_df:pd.DataFrame, class_names:list)->pd.DataFrame:
+    """Returns the total number of days each SEQN has taken drugs in each Drug Class. When
+    a drug code appears more than once for a SEQN, the last row is used; 77777 (Refused) 
+    and 99999 (Don't know) count as 0 days and a missing number of days makes the total
+    missing.
 
     Args:
-        dict_drugs_seqn (dict): Dict where the keys are SEQN numbers and the values 
-        are list of drug codes of the meds hat SEQN takes
-        drug_info_df (pd.DataFrame): File containing Drug Information for a year bracket.
+        meds_df (pd.DataFrame): Prescription Medications with Drug Classes
+        class_names (list): Drug Classes (dummy columns)
 
     Returns:
-        dict: dict of SEQN and list of Drug Classes
+        pd.DataFrame: number of days drugs in each Drug Class were taken, indexed by SEQN
     """
-    dict_dummy_cols_seqn = {}
-    for seqn in dict_drugs_seqn:
-        drugs_codes_used = dict_drugs_seqn[seqn]
-        dummy_cols = []
-        for drug_code in drugs_codes_used:
-            dummy_col = drug_code_to_dummy_col(drug_code, drug_info_df)
-            dummy_cols.append(dummy_col)
-        dict_dummy_cols_seqn[seqn] = dummy_cols
-    return dict_dummy_cols_seqn
-
-def dict_num_pres_meds_for_seqn(df:pd.DataFrame)->dict:
-    """Returns a dict of the number of prescription meds each SEQN takes.
+    meds_df = meds_df.drop_duplicates(['SEQN', 'RXDDRGID'], keep='last')
+    days_taken = meds_df['Days_Taken'].mask(meds_df['Days_Taken'].isin([77777, 99999]), 0)
+    groups = [meds_df['SEQN'], meds_df['Drug_Class']]
+    total_days = days_taken.fillna(0).groupby(groups, observed=True).sum().unstack(fill_value=0)
+    any_missing = days_taken.isnull().groupby(groups, observed=True).any().unstack(fill_value=False)
+    total_days = total_days.mask(any_missing).astype(float)
+    return total_days.reindex(index=pd.Index(meds_df['SEQN'].unique()).sort_values(),\
+        columns=class_names, fill_value=0)
+
+def pres_meds_files(year:str)->list:
+    """Returns the Prescription Medications data file and Drug Information file of a year bracket.
 
     Args:
-        df (pd.DataFrame): DataFrame of Prescription Medications file
+        year (str): Year bracket (1999-2000, 2001-2002, ..., 2017-2018)
 
     Returns:
-        dict: dict of the number of prescription meds each SEQN takes.
+        list: [data file, drug information file]
     """
-    dict_num_pres_meds = {}
-    if 'RXD295' in df.columns:
-        df_with_seqn_and_med_count = df[['SEQN', 'RXD295', 'RXDDRGID']]
-        df_with_seqn_and_med_count = df_with_seqn_and_med_count[df_with_seqn_and_med_count['RXDDRGID'] != '']
-        for seqn in df_with_seqn_and_med_count['SEQN'].unique():
-            df_seqn = df_with_seqn_and_med_count[df_with_seqn_and_med_count['SEQN'] == seqn]
-            med_count = df_seqn.iloc[0][1]
-            if (seqn not in dict_num_pres_meds) and (not np.isnan(med_count)):
-                dict_num_pres_meds[seqn] = med_count
-        return dict_num_pres_meds
-    else:
-        # RXDCOUNT column present
-        df_with_seqn_and_med_count = df[['SEQN', 'RXDCOUNT', 'RXDDRGID']]
-        df_with_seqn_and_med_count = df_with_seqn_and_med_count[df_with_seqn_and_med_count['RXDDRGID'] != '']
-        for seqn in df_with_seqn_and_med_count['SEQN'].unique():
-            df_seqn = df_with_seqn_and_med_count[df_with_seqn_and_med_count['SEQN'] == seqn]
-            med_count = df_seqn.iloc[0][1]
-            if (seqn not in dict_num_pres_meds) and (not np.isnan(med_count)):
-                dict_num_pres_meds[seqn] = med_count
-        return dict_num_pres_meds
+    data_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year, 'Questionnaire data',\
+        'Prescription Medications/Data file', year + '_Prescription Medications.XPT')
+    drug_info_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year,'Questionnaire data',\
+        'Prescription Medications - Drug Information/Data file',\
+            year + '_Prescription Medications - Drug Information.xpt')
+    return [data_file, drug_info_file]
 
-def dummy_col_df(dict_seqn_dummy_cols:dict)->pd.DataFrame:
-    """Returns a DataFrame of Prescription Meds info including dummy columns.
+def updated_pres_meds_df(year:str, class_names:dict=None, seqns=None)->pd.DataFrame:
+    """Returns an updated dataframe of Prescription Medications
 
     Args:
-        dict_seqn_dummy_cols (dict): Dictionary of SEQN and their corresponding list
-        of dummy columns.
+        year (str): Year bracket (1999-2000, 2001-2002, ..., 2017-2018)
+        class_names (dict, optional): Drug Classes and their category codes.
+        Defaults to None (drug_class_names).
+        seqns (list-like, optional): SEQN to keep. Defaults to None (every SEQN).
 
     Returns:
-        pd.DataFrame: DataFrame with dummy columns.
+        pd.DataFrame: Dataframe of Prescription Medications
     """
-    dict_drug_class_seqn = {'AntiInfectives': [], 'Cardiovascular_Coag_Agents': [], 'Other_System_Agents': [],\
-        'Hormones_Modifiers': [],'Immunomodulators': [], 'Antihyperlipidemic_Agents': [], 'AntiDiabetic_Agents': [],\
-        'Others': []}
-
-    dict_seqn_dummy_cols_count = {}
-    for seqn in dict_seqn_dummy_cols:
-        counter = {drug_class: dict_seqn_dummy_cols[seqn].count(drug_class) \
-            for drug_class in list(dict_drug_class_seqn.keys())}
-        dict_seqn_dummy_cols_count[seqn] = counter
-    
-    for seqn in dict_seqn_dummy_cols_count:
-        drug_class_counts = dict_seqn_dummy_cols_count[seqn]
-        for drug_class in drug_class_counts:
-            dict_drug_class_seqn[drug_class].append(drug_class_counts[drug_class])
+    data_file, drug_info_file = pres_meds_files(year)
+    data_df = read_xpt_cached(data_file)
+    if seqns is not None:
+        data_df = data_df[data_df['SEQN'].isin(seqns)].copy()
+    drug_info_df = read_xpt_cached(drug_info_file)
+    if class_names is None:
+        class_names = drug_class_names
     
-    df = {'SEQN': list(dict_seqn_dummy_cols_count.keys())}
-    for drug_class in dict_drug_class_seqn:
-        df[drug_class] = dict_drug_class_seqn[drug_class]
-    
-    df = pd.DataFrame(df)
+    # Make sure the drug codes are strings
+    data_df['RXDDRGID'] = decode_byte_strings(data_df['RXDDRGID'])
+    drug_info_df['RXDDRGID'] = decode_byte_strings(drug_info_df['RXDDRGID'])
+
+    # Every drug taken by a SEQN joined with its Drug Class
+    meds_df = pres_meds_with_drug_classes(data_df, drug_info_df, class_names)
+    # Column for number of Prescription Meds (in total) taken per patient, from the first row of the SEQN
+    pres_med_count = meds_df.drop_duplicates('SEQN').set_index('SEQN')['Med_Count'].sort_index()
+    # Number of drugs taken in dummy cols and total number of days drugs in a dummy col drug 
+    # class were taken
+    drug_class_counts = num_drugs_in_drug_classes(meds_df, list(class_names))
+    drug_class_days = num_days_drug_classes_taken(meds_df, list(class_names))
+
+    df = pd.concat([pres_med_count.rename('PRES_MED_COUNT'), drug_class_counts,\
+        drug_class_days.add_prefix('Num_Days_Taken_')], axis=1)
+    df.index.name = 'SEQN'
+    df = df.reset_index()
     return df
 
-def num_days_drugs_taken_by_SEQN(df:pd.DataFrame, seqn:int)->dict:
-    """Returns a dict of the drugs taken by each SEQN and how many days
-    each were taken.
+# 2.2 Dietary Supplements: Create dataframes for each year bracket
+# Ingredient categories (DSDCAT) of the Dietary Supplement Database and their columns
+ingredient_cat_cols = {1: 'Ingredient1_Vitamin', 2: 'Ingredient2_Mineral', 3: 'Ingredient3_Botanical',\
+    4: 'Ingredient4_Other', 5: 'Ingredient5_Amino_Acid'}
+
+def supplement_products(data_df:pd.DataFrame, product_info_df:pd.DataFrame, year:str)->pd.DataFrame:
+    """Returns the product (DSDPID) of every dietary supplement taken by each SEQN.
 
     Args:
-        df (pd.DataFrame): DataFrame of Prescription Medications file
-        seqn (int): patient SEQN number
+        data_df (pd.DataFrame): DataFrame of Individual Dietary Supplements file
+        product_info_df (pd.DataFrame): Dietary Supplement Product Info dataframe.
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
 
     Returns:
-        dict: dict of the drugs taken by each SEQN and how many days
-        each were taken.
+        pd.DataFrame: SEQN and DSDPID of each supplement taken
     """
-    dict_num_days_drugs_taken = {}
-    if 'RXD260' in df.columns:
-        df_with_seqn_drug_and_days_taken = df[['SEQN', 'RXDDRGID', 'RXD260']]
-        df_for_seqn = df_with_seqn_drug_and_days_taken[df_with_seqn_drug_and_days_taken['SEQN'] == seqn]
-        for i in range(len(df_for_seqn)):
-            drug_code = df_for_seqn.iloc[i][1]
-            num_days_taken = df_for_seqn.iloc[i][2]
-            # condition for 99999 / 77777 values:
-            if (num_days_taken == 99999) or (num_days_taken == 77777):
-                dict_num_days_drugs_taken[drug_code] = 0 # instead of np.NaN because then, when
-                # summing, the result would be NaN
-            else:
-                dict_num_days_drugs_taken[drug_code] = num_days_taken
-        return dict_num_days_drugs_taken
-    else:
-        # 'RXDDAYS' in columns:
-        df_with_seqn_drug_and_days_taken = df[['SEQN', 'RXDDRGID', 'RXDDAYS']]
-        df_for_seqn = df_with_seqn_drug_and_days_taken[df_with_seqn_drug_and_days_taken['SEQN'] == seqn]
-        for i in range(len(df_for_seqn)):
-            drug_code = df_for_seqn.iloc[i][1]
-            num_days_taken = df_for_seqn.iloc[i][2]
-            # condition for 99999 / 77777 values:
-            if (num_days_taken == 99999) or (num_days_taken == 77777):
-                dict_num_days_drugs_taken[drug_code] = 0 # instead of np.NaN because then, when
-                # summing, the result would be NaN
-            else:
-                dict_num_days_drugs_taken[drug_code] = num_days_taken
-        return dict_num_days_drugs_taken
-
-def dict_num_days_drugs_taken_for_SEQN(df:pd.DataFrame)->dict:
-    """Returns a dict of the drugs each SEQN takes and for how many days.
-
-    Args:
-        df (pd.DataFrame): DataFrame of Prescription Medications file
-
-    Returns:
-        dict: dict of the drugs each SEQN takes and for how many days.
-    """ 
-    dict_num_drugs_taken = {}
-    if 'RXD260' in df.columns:
-        df_with_seqn_and_num_day_drugs_taken = df[['SEQN', 'RXD260', 'RXDDRGID']]
-        df_with_seqn_and_num_day_drugs_taken = df_with_seqn_and_num_day_drugs_taken[df_with_seqn_and_num_day_drugs_taken['RXDDRGID'] != '']
-        for seqn in df_with_seqn_and_num_day_drugs_taken['SEQN'].unique():
-            dict_drugs_and_days_taken = num_days_drugs_taken_by_SEQN(df_with_seqn_and_num_day_drugs_taken, seqn)
-            if (seqn not in dict_num_drugs_taken): 
-                dict_num_drugs_taken[seqn] = dict_drugs_and_days_taken
-        return dict_num_drugs_taken
-    else:
-        # 'RXDDAYS' in columns:
-        df_with_seqn_and_num_day_drugs_taken = df[['SEQN', 'RXDDAYS', 'RXDDRGID']]
-        df_with_seqn_and_num_day_drugs_taken = df_with_seqn_and_num_day_drugs_taken[df_with_seqn_and_num_day_drugs_taken['RXDDRGID'] != '']
-        for seqn in df_with_seqn_and_num_day_drugs_taken['SEQN'].unique():
-            dict_drugs_and_days_taken = num_days_drugs_taken_by_SEQN(df_with_seqn_and_num_day_drugs_taken, seqn)
-            if (seqn not in dict_num_drugs_taken): 
-                dict_num_drugs_taken[seqn] = dict_drugs_and_days_taken
-        return dict_num_drugs_taken
-
-def dict_days_seqn_takes_drugs_in_dummy_col(dict_drugs_taken:dict, drug_info_df:pd.DataFrame)->dict:
-    """Returns a dict with the drug codes replaced by their corresponding dummy 
-    column names and sums up the total number of days the drugs under one dummy
-    column names were taken. 
-
-    Args:
-        dict_drugs_taken (dict): dict of SEQN and the number of days each drug code was taken.
-        drug_info_df (pd.DataFrame): File containing Drug Information for a year bracket.
+    if year == '2017-2018':
+        # The 2017-2018 file already contains the DSDPID of the supplements
+        valid_products = (1 < data_df['DSDPID']) & (data_df['DSDPID'] < 19767)
+        return data_df.loc[valid_products, ['SEQN', 'DSDPID']]
+
+    # Only Supplement IDs starting with 1 are products of the Dietary Supplement Database
+    supp_ids = decode_byte_strings(data_df['DSDSUPID'])
+    supps_df = pd.DataFrame({'SEQN': data_df['SEQN'], 'DSDSUPID': pd.to_numeric(supp_ids)})
+    supps_df = supps_df[supp_ids.str.startswith('1').fillna(False).astype(bool)]
+    # Make sure the Dietary Supplement IDs are ints
+    products_df = pd.DataFrame({'DSDSUPID': pd.to_numeric(decode_byte_strings(product_info_df['DSDSUPID'])),\
+        'DSDPID': product_info_df['DSDPID']})
+    products_df = products_df.dropna(subset=['DSDSUPID']).drop_duplicates('DSDSUPID')
+    return supps_df.merge(products_df, on='DSDSUPID', how='inner')[['SEQN', 'DSDPID']]
+
+def ingredient_cat_masks(ingredient_info_df:pd.DataFrame)->pd.Series:
+    """Returns the ingredient categories of each product (DSDPID) as a 5-bit mask: bit
+    i-1 is set if the product contains ingredients in category i (1: Vitamin, 2: Mineral,
+    3: Botanical, 4: Other, 5: Amino Acid).
+
+    Args:
+        ingredient_info_df (pd.DataFrame): Dietary Supplement Ingredient Info dataframe.
 
     Returns:
-        dict: dict with SEQN and the total number of days drugs in each dummy col were taken.
+        pd.Series: uint8 mask indexed by DSDPID
     """
-    num_days_seqn_takes_drugs_in_dummy_col = {}
-    for seqn in dict_drugs_taken:
-        dict_num_days_taken = {'AntiInfectives': 0, 'Cardiovascular_Coag_Agents': 0,\
-            'Other_System_Agents': 0,'Hormones_Modifiers': 0, 'Immunomodulators': 0,\
-                'Antihyperlipidemic_Agents': 0, 'AntiDiabetic_Agents': 0, 'Others': 0}
-
-        dict_num_days_each_seqn_takes_drug = dict_drugs_taken[seqn]
-        for drug_code in dict_num_days_each_seqn_takes_drug:
-            num_days_taken = dict_num_days_each_seqn_takes_drug[drug_code]
-            dummy_col = drug_code_to_dummy_col(drug_code, drug_info_df)
-            dict_num_days_taken[dummy_col] += num_days_taken
-        num_days_seqn_takes_drugs_in_dummy_col[seqn] = dict_num_days_taken
-    return num_days_seqn_takes_drugs_in_dummy_col
-
-def num_days_dummy_col_meds_taken_df(dict_seqn_dummy_cols_num_days:dict)->pd.DataFrame:
-    """Returns a dataframe with the columns representing the total number of days each SEQN
-    has taken drugs in a dummy col drug class.
+    ing_df = ingredient_info_df.loc[ingredient_info_df['DSDCAT'].isin(list(ingredient_cat_cols)),\
+        ['DSDPID', 'DSDCAT']].drop_duplicates()
+    # Each (DSDPID, DSDCAT) pair sets a different bit, so the sum is the bitwise OR
+    cat_bits = np.left_shift(1, ing_df['DSDCAT'].to_numpy().astype(np.uint8) - 1).astype(np.uint8)
+    masks = pd.Series(cat_bits, index=ing_df['DSDPID']).groupby(level=0).sum()
+    return masks.astype(np.uint8)
+
+# Ingredient category masks already loaded by this process, keyed by content hash of the
+# Ingredient Information file
+loaded_ingredient_cat_masks = {}
+
+def ingredient_cat_mask_index(ingredient_info_file:str)->pd.Series:
+    """Returns the ingredient category mask of each product of an Ingredient Information
+    file. The index is stored in the cache directory under the content hash of the file, 
+    so year brackets released with the same Dietary Supplement Database share it, and the
+    code version of ingredient_cat_masks, so a change to how masks are made rebuilds it.
 
     Args:
-        dict_seqn_dummy_cols_num_days (dict): dict with each SEQN and the number of days
-        they take drugs in each dummy col drug class.
+        ingredient_info_file (str): location of the Ingredient Information .xpt file
 
     Returns:
-        pd.DataFrame: dataframe with the columns representing the total number of days each SEQN
-        has taken drugs in a dummy col drug class.
+        pd.Series: uint8 mask indexed by DSDPID
     """
-    dict_dummy_cols_seqn = {'Num_Days_Taken_AntiInfectives': [], 'Num_Days_Taken_Cardiovascular_Coag_Agents': [],\
-        'Num_Days_Taken_Other_System_Agents': [], 'Num_Days_Taken_Hormones_Modifiers': [],'Num_Days_Taken_Immunomodulators': [],\
-            'Num_Days_Taken_Antihyperlipidemic_Agents': [], 'Num_Days_Taken_AntiDiabetic_Agents': [],\
-                'Num_Days_Taken_Others': []}
-    
-    for seqn in dict_seqn_dummy_cols_num_days:
-        dict_for_seqn = dict_seqn_dummy_cols_num_days[seqn]
-        for dummy_col in dict_for_seqn:
-            num_days_taken = dict_for_seqn[dummy_col]
-            for col_name in dict_dummy_cols_seqn:
-                if dummy_col in col_name:
-                    dict_dummy_cols_seqn[col_name].append(num_days_taken)
-    
-    df = {'SEQN': list(dict_seqn_dummy_cols_num_days.keys())}
-    for num_days_dummy_col in dict_dummy_cols_seqn:
-        df[num_days_dummy_col] = dict_dummy_cols_seqn[num_days_dummy_col]
-    df = pd.DataFrame(df)
-    
-    return df
-
-def updated_pres_meds_df(year:str)->pd.DataFrame:
-    """Returns an updated dataframe of Prescription Medications
+    content_hash = file_content_hash(ingredient_info_file)
+    if content_hash not in loaded_ingredient_cat_masks:
+        index_loc = os.path.join(xpt_cache_dir, '{}_{}_ingredient_cat_masks.pkl'.format(content_hash,\
+            code_version([ingredient_cat_masks])))
+        if os.path.isfile(index_loc):
+            masks = pd.read_pickle(index_loc)
+        else:
+            masks = ingredient_cat_masks(read_xpt_cached(ingredient_info_file, columns=['DSDPID', 'DSDCAT']))
+            os.makedirs(xpt_cache_dir, exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(index_loc, os.getpid())
+            masks.to_pickle(tmp_path)
+            os.replace(tmp_path, index_loc)
+        loaded_ingredient_cat_masks[content_hash] = masks
+    return loaded_ingredient_cat_masks[content_hash]
+
+def seqn_ingredient_cats(seqn_products_df:pd.DataFrame, masks:pd.Series)->pd.DataFrame:
+    """Returns which of the 5 ingredient categories the supplements of each SEQN contain
+    ingredients in, from the bitwise OR of the masks of their products.
 
     Args:
-        year (str): Year bracket (1999-2000, 2001-2002, ..., 2017-2018)
+        seqn_products_df (pd.DataFrame): SEQN and DSDPID of each supplement taken
+        masks (pd.Series): ingredient category mask indexed by DSDPID
 
     Returns:
-        pd.DataFrame: Dataframe of Prescription Medications
+        pd.DataFrame: SEQN and one 0/1 column per ingredient category
     """
-    data_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year, 'Questionnaire data',\
-        'Prescription Medications/Data file', year + '_Prescription Medications.XPT')
-    drug_info_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year,'Questionnaire data',\
-        'Prescription Medications - Drug Information/Data file',\
-            year + '_Prescription Medications - Drug Information.xpt')
-    data_df = pd.read_sas(data_file)
-    drug_info_df = pd.read_sas(drug_info_file)
-    
-    # Make sure the drug codes are strings
-    drug_codes = list(data_df['RXDDRGID'])
-    drug_codes_edited = []
-    for a_drug_code in drug_codes:
-        string_code = str(a_drug_code)
-        split = string_code.split('\'')
-        drug_codes_edited.append(split[1])
-    data_df['RXDDRGID'] = drug_codes_edited
-
-    drug_codes = list(drug_info_df['RXDDRGID'])
-    drug_codes_edited = []
-    for a_drug_code in drug_codes:
-        string_code = str(a_drug_code)
-        split = string_code.split('\'')
-        drug_codes_edited.append(split[1])
-    drug_info_df['RXDDRGID'] = drug_codes_edited
-
-    # Column for number of Prescription Meds (in total) taken per patient
-    dict_seqn_num_pres_meds = dict_num_pres_meds_for_seqn(data_df) 
-
-    dict_drugs_by_seqn = {} 
-    for seqn in data_df['SEQN']:
-        drugs_for_seqn = drugs_used_by_SEQN(data_df, seqn)
-        if drugs_for_seqn != []:
-            dict_drugs_by_seqn[seqn] = drugs_for_seqn
-    
-    # What Drug Classes dummy columns to fill for each SEQN
-    dict_seqn_dummy_cols = dict_dummy_cols_for_seqn(dict_drugs_by_seqn, drug_info_df)
-    # Dataframe with SEQN, and all dummy columns
-    df_dummy_cols = dummy_col_df(dict_seqn_dummy_cols) 
-    # Dataframe with SEQN, number of drugs taken in dummy cols, and total number of meds taken:
-    df1 = pd.DataFrame({'SEQN': list(dict_drugs_by_seqn.keys()),\
-        'PRES_MED_COUNT': list(dict_seqn_num_pres_meds.values())})
-    df1 = df1.merge(df_dummy_cols, on='SEQN', how='outer', sort=True)
-
-    # Total number of days drugs in a dummy col drug class taken:
-    dict_num_days_med_taken_for_seqn = dict_num_days_drugs_taken_for_SEQN(data_df)
-    dict_num_days_dummy_col_taken_for_seqn = \
-        dict_days_seqn_takes_drugs_in_dummy_col(dict_num_days_med_taken_for_seqn, drug_info_df)
-    df2 = num_days_dummy_col_meds_taken_df(dict_num_days_dummy_col_taken_for_seqn)
-    
-    df = pd.merge(df1, df2, on='SEQN', how='outer', sort=True)
-    return df
+    seqn_products_df = seqn_products_df.sort_values('SEQN', kind='stable')
+    product_masks = seqn_products_df['DSDPID'].map(masks).fillna(0).to_numpy().astype(np.uint8)
+    seqns = seqn_products_df['SEQN'].to_numpy()
+    if len(seqns) == 0:
+        return pd.DataFrame(columns=['SEQN'] + list(ingredient_cat_cols.values()))
+    group_starts = np.flatnonzero(np.r_[True, seqns[1:] != seqns[:-1]])
+    seqn_masks = np.bitwise_or.reduceat(product_masks, group_starts)
+    df = {'SEQN': seqns[group_starts]}
+    for ing_cat in ingredient_cat_cols:
+        df[ingredient_cat_cols[ing_cat]] = (seqn_masks >> (ing_cat - 1)) & 1
+    return pd.DataFrame(df)
+
+@lru_cache(maxsize=None)
+def dietary_supplement_file_paths()->list:
+    """Returns the file paths of the Individual Dietary Supplements files of every year
+    bracket. Computed on first use and cached.
 
-# 2.2 Dietary Supplements: Create dataframes for each year bracket
-def supp_for_SEQN(df:pd.DataFrame, seqn:int)->list:
-    """Returns a list of the Dietary Supplement IDs of those used by
-    SEQN from df.
+    Returns:
+        list: list of file paths
+    """
+    d = os.path.join(root_loc, 'diabetes/NHANES data')
+    lst = locate_xpt_files(d)
+    # Get all file names in folder
+    lst = [str(s) for s in lst]
+    # Get only Dietary data file names in folder
+    lst = [s for s in lst if ('Dietary data' in s)]
+    # Get only Dietary Supplement Use file names in folder
+    lst = [s for s in lst if ('Dietary Supplement Use 30' in s)]
+    # Get only Individual Dietary Supplements file names in folder
+    file_paths = []
+    for s in lst:
+        if ('File 2' in s) or ('Individual Dietary Supplements' in s):
+            file_paths.append(s)
+    return file_paths
+
+def diet_supp_files(year:str)->list:
+    """Returns the Individual Dietary Supplements file, Product Information file and 
+    Ingredient Information file of a year bracket.
 
     Args:
-        df (pd.DataFrame): DataFrame of Dietary Supplement file
-        seqn (int): patient SEQN number
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
 
     Returns:
-        list: List of Dietary Supplement IDs taken by each SEQN
+        list: [data file, product information file, ingredient information file]
     """
-    df_with_only_seqn = df[df['SEQN'] == seqn]
-    supp_ids = list(df_with_only_seqn['DSDSUPID'])
-    return supp_ids
+    for file_path in dietary_supplement_file_paths():
+        if year in file_path:
+            data_file = file_path
+    
+    product_info_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year,\
+        'Dietary data','Dietary Supplement Database - Product Information/Data file',\
+            year + '_Dietary Supplement Database - Product Information.XPT')
+    ingredient_info_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year,\
+        'Dietary data','Dietary Supplement Database - Ingredient Information/Data file',\
+            year + '_Dietary Supplement Database - Ingredient Information.XPT')
+    return [data_file, product_info_file, ingredient_info_file]
 
-def DSDPIDs_from_supp_IDs(list_supp_id:list, prod_info_df:pd.DataFrame)->int:
-    """Returns a list of DSDPIDs of Dietary Supplement IDs.
+def diet_supp_df(year:str, seqns=None)->pd.DataFrame:
+    """Returns an updated df containing Dietary Supplement Info for each SEQN.
 
     Args:
-        list_supp_id (int): list of Dietary Supplement IDs
-        prod_info_df (pd.DataFrame): Dietary Supplement Product Info dataframe.
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
+        seqns (list-like, optional): SEQN to keep. Defaults to None (every SEQN).
 
     Returns:
-        int: list of DSDPIDs
+        pd.DataFrame: Dietary Supplement df.
     """
-    list_DSDPIDs = []
-    for supp_id in list_supp_id:
-        if ((str(supp_id)[0] == '1') and (not pd.isnull(supp_id))):
-            supp_id_df = prod_info_df[prod_info_df['DSDSUPID'] == supp_id]
-            dsdpid = supp_id_df['DSDPID'].iloc[0]
-            list_DSDPIDs.append(dsdpid)
-    #else:
-        #return np.NaN
-        return list_DSDPIDs
+    data_file, product_info_file, ingredient_info_file = diet_supp_files(year)
+    data_df = read_xpt_cached(data_file)
+    if seqns is not None:
+        data_df = data_df[data_df['SEQN'].isin(seqns)]
+    product_info_df = read_xpt_cached(product_info_file)
+
+    # Ingredient cats for each SEQN: supplements -> products -> ingredient category masks
+    seqn_products_df = supplement_products(data_df, product_info_df, year)
+    df = seqn_ingredient_cats(seqn_products_df, ingredient_cat_mask_index(ingredient_info_file))
+    return df    
 
-def DSPID_to_ing_cats(dsdpid:int, ing_info_df:pd.DataFrame)->dict:
-    """Returns a dict showing the 5 ingredient categories the DSPID product contain
-    ingredients in.
+# 2.2.1 Other files with repeated SEQN: each file is turned into one row per SEQN following a 
+#       declarative aggregation spec. The files are read in chunks and aggregated while being read,
+#       since some of them (e.g. Individual Foods) are too large to load whole
+# Aggregation specs. Each spec names the files it applies to (root category and a pattern of the
+# file name), the key column, the columns whose values become separate columns (group_cols), a 
+# regex of the columns to aggregate and the reductions ('sum', 'mean', 'count', 'min', 'max')
+repeated_seqn_aggregations = [
+    # Nutrient amounts of each food reported in the Dietary Recall interviews (DR1I..., DR2I... 
+    # and DRXI... in 1999-2002), without the food code and line number
+    {'root_cat': 'Dietary data', 'file_pattern': 'Individual Foods', 'key': 'SEQN', 'group_cols': [],\
+        'columns': r'^DR[12X]I(?!FDCD$|LINE$)[A-Z0-9]+$', 'reductions': ['sum', 'mean', 'count']},
+    # Times, duration and MET score of each physical activity, per activity level (moderate/vigorous)
+    {'root_cat': 'Questionnaire data', 'file_pattern': 'Physical Activity - Individual Activities',\
+        'key': 'SEQN', 'group_cols': ['PADLEVEL'], 'columns': r'^(PADTIMES|PADDURAT|PADMETS)$',\
+            'reductions': ['sum', 'max', 'count']}, 
+    # Nutrient amounts of each dietary supplement taken on the days of the Dietary Recall 
+    # interviews (DS1I..., DS2I...)
+    {'root_cat': 'Dietary data', 'file_pattern': 'Dietary Supplement Use 24-Hour - Individual Dietary Supplements',\
+        'key': 'SEQN', 'group_cols': [], 'columns': r'^DS[12]I[A-Z0-9]+$', 'reductions': ['sum', 'count']},
+    # Intensity and step counts of each minute recorded by the Physical Activity Monitor (2003-2006)
+    {'root_cat': 'Examination data', 'file_pattern': 'Physical Activity Monitor', 'key': 'SEQN',\
+        'group_cols': [], 'columns': r'^(PAXINTEN|PAXSTEP)$', 'reductions': ['sum', 'mean', 'max', 'count']}]
+# How the running aggregates of two chunks are combined
+chunk_reductions = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+def aggregate_xpt_long_to_wide(xpt_loc:str, key:str='SEQN', group_cols:list=None, columns=None,\
+    reductions:list=None, chunksize:int=100000, keys_to_keep=None)->pd.DataFrame:
+    """Returns the reductions of the numeric columns of an .xpt file for each key (and each 
+    combination of values of group_cols, which become separate columns). The file is read 
+    chunksize rows at a time and only the running aggregates per key are kept in memory.
 
     Args:
-        dsdpid (int): DSPID
-        ing_info_df (pd.DataFrame): Dietary Supplement Ingredient Info dataframe.
+        xpt_loc (str): location of .xpt file
+        key (str, optional): column to aggregate on. Defaults to 'SEQN'.
+        group_cols (list, optional): columns whose values become separate columns. Defaults to None.
+        columns (list or callable, optional): list of column names to aggregate, or a function
+        taking a column name and returning True if the column should be aggregated. Defaults 
+        to None (every numeric column).
+        reductions (list, optional): reductions among 'sum', 'mean', 'count' (number of 
+        non-missing values), 'min' and 'max'. Defaults to None (sum, mean and count).
+        chunksize (int, optional): number of rows per chunk. Defaults to 100000.
+        keys_to_keep (list-like, optional): keys whose rows are aggregated, the other rows are
+        dropped while reading. Defaults to None (every key).
 
     Returns:
-        dict: dict showing the 5 ingredient categories the DSPID product contain
-        ingredients in
+        pd.DataFrame: one '<column>_<REDUCTION>[_<group col>_<value>...]' column per column, 
+        reduction and group, indexed by key
     """
-    dict_ing_cats = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-    dsdpid_df = ing_info_df[ing_info_df['DSDPID'] == dsdpid]
-    ing_cats = list(dsdpid_df['DSDCAT'].unique())
-    for ing_cat in ing_cats:
-        if ing_cat in dict_ing_cats.keys():
-            dict_ing_cats[ing_cat] = 1
-    return dict_ing_cats
+    if group_cols is None:
+        group_cols = []
+    if reductions is None:
+        reductions = ['sum', 'mean', 'count']
+    keys = [key] + group_cols
+    header = read_xpt_header(xpt_loc)
+    value_cols = [col['name'] for col in header['columns'] if (col['type'] == 'numeric') and\
+        (col['name'] not in keys) and column_is_selected(col['name'], columns)]
+    if value_cols == []:
+        return pd.DataFrame(index=pd.Index([], name=key))
+    # Running aggregates: sums and counts are needed for means, and counts tell a sum of no
+    # values (missing) from a sum of 0
+    running = set([r for r in reductions if r != 'mean'] + (['sum', 'count'] if 'mean' in reductions else []))
+    if 'sum' in running:
+        running.add('count')
+    aggregates = {}
+    for chunk in iter_xpt_chunks(xpt_loc, columns=keys + value_cols, chunksize=chunksize):
+        if keys_to_keep is not None:
+            chunk = chunk[chunk[key].isin(keys_to_keep)]
+        for col in group_cols:
+            if chunk[col].dtype == object:
+                chunk[col] = decode_byte_strings(chunk[col])
+        grouped = chunk.groupby(keys)[value_cols]
+        for reduction in running:
+            chunk_aggregate = grouped.agg(reduction)
+            if reduction in aggregates:
+                chunk_aggregate = pd.concat([aggregates[reduction], chunk_aggregate])\
+                    .groupby(level=keys).agg(chunk_reductions[reduction])
+            aggregates[reduction] = chunk_aggregate
+    if aggregates == {}:
+        return pd.DataFrame(index=pd.Index([], name=key))
+
+    counts = aggregates.get('count')
+    if 'sum' in aggregates:
+        aggregates['sum'] = aggregates['sum'].mask(counts == 0)
+    if 'mean' in reductions:
+        aggregates['mean'] = aggregates['sum'] / counts.mask(counts == 0)
+
+    wide_dfs = []
+    for reduction in reductions:
+        df = aggregates[reduction]
+        if group_cols != []:
+            df = df.unstack(group_cols)
+            df.columns = ['_'.join([col, reduction.upper()] + ['{}_{:g}'.format(group_col, value)\
+                if isinstance(value, float) else '{}_{}'.format(group_col, value)\
+                    for group_col, value in zip(group_cols, values)])\
+                for col, *values in df.columns]
+        else:
+            df = df.add_suffix('_' + reduction.upper())
+        if reduction == 'count':
+            df = df.fillna(0).astype(int)
+        wide_dfs.append(df)
+    return pd.concat(wide_dfs, axis=1)
 
-def ing_cats_for_SEQN(list_DSDPIDs:list, ing_info_df:pd.DataFrame)->dict:
-    """Returns a dict of ingredient categories under which the dietary
-    supplements a SEQN takes falls.
+def repeated_seqn_files(year:str, spec:dict)->list:
+    """Returns the files with repeated SEQN of a year bracket that an aggregation spec applies to.
 
     Args:
-        list_DSDPIDs (list): list of supplement DSDPIDs for each SEQN
-        ing_info_df (pd.DataFrame): Dietary Supplement Ingredient Info dataframe.
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
+        spec (dict): aggregation spec
 
     Returns:
-        dict: dict of ingredient categories under which the dietary
-        supplements a SEQN takes falls.
+        list: list of file paths
     """
-    SEQN_ing_cat = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-    #all_dsdpids = {}
-    new_list_DSDPIDs = [dsdpid for dsdpid in list_DSDPIDs if not pd.isnull(dsdpid)]
-    for dsdpid in new_list_DSDPIDs:
-        dict_dsdpid_ing_cats = DSPID_to_ing_cats(dsdpid, ing_info_df)
-        for ing_cat in dict_dsdpid_ing_cats:
-            if dict_dsdpid_ing_cats[ing_cat] == 1:
-                SEQN_ing_cat[ing_cat] = 1
-    return SEQN_ing_cat
-
-d = os.path.join(root_loc, 'diabetes/NHANES data')
-lst = locate_xpt_files(d)
-# Get all file names in folder
-lst = [str(s) for s in lst]
-# Get only Dietary data file names in folder
-lst = [s for s in lst if ('Dietary data' in s)]
-# Get only Dietary Supplement Use file names in folder
-lst = [s for s in lst if ('Dietary Supplement Use 30' in s)]
-# Get only Individual Dietary Supplements file names in folder
-file_paths = []
-for s in lst:
-    if ('File 2' in s) or ('Individual Dietary Supplements' in s):
-        file_paths.append(s)
+    catalog = xpt_catalog()
+    files = catalog.loc[(catalog['year'] == year) & (catalog['root_cat'] == spec['root_cat']) &\
+        (catalog['seqn_unique'] == False), 'path']
+    return sorted([f for f in files if spec['file_pattern'] in f])
 
-def diet_supp_df(year:str)->pd.DataFrame:
-    """Returns an updated df containing Dietary Supplement Info for each SEQN.
+def repeated_seqn_df(year:str, specs:list=None, seqns=None)->pd.DataFrame:
+    """Returns a df containing one row per SEQN with the aggregates of every file with
+    repeated SEQN of a year bracket that an aggregation spec applies to.
 
     Args:
         year (str): year bracket ('1999-2000', ..., '2017-2018')
+        specs (list, optional): aggregation specs. Defaults to None (repeated_seqn_aggregations).
+        seqns (list-like, optional): SEQN to keep. Defaults to None (every SEQN).
 
     Returns:
-        pd.DataFrame: Dietary Supplement df.
+        pd.DataFrame: aggregates df.
     """
-    for file_path in file_paths:
-        if year in file_path:
-            data_df = pd.read_sas(file_path)
-    
-    product_info_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year,\
-        'Dietary data','Dietary Supplement Database - Product Information/Data file',\
-            year + '_Dietary Supplement Database - Product Information.XPT')
-    ingredient_info_file = os.path.join(root_loc, 'diabetes/NHANES data/NHANES ' + year,\
-        'Dietary data','Dietary Supplement Database - Ingredient Information/Data file',\
-            year + '_Dietary Supplement Database - Ingredient Information.XPT')
-    product_info_df = pd.read_sas(product_info_file)
-    ingredient_info_df = pd.read_sas(ingredient_info_file)
-
-    if year != '2017-2018':
-        supp_ids = list(data_df['DSDSUPID'])
-        supp_ids_edited = []
-        for supp_id in supp_ids:
-            string_id = str(supp_id)
-            split = string_id.split('\'')
-            supp_ids_edited.append(int(split[1]))
-        data_df['DSDSUPID'] = supp_ids_edited
-        
-        # for each SEQN, get a list of supplement IDs
-        supp_for_each_SEQN = {}
-        for seqn in data_df['SEQN'].unique():
-            supp_for_each_SEQN[seqn] = supp_for_SEQN(data_df, seqn)
-
-        # Make sure the Dietary Supplement IDs are ints
-        supp_ids = list(product_info_df['DSDSUPID'])
-        supp_ids_edited = []
-        for supp_id in supp_ids:
-            string_id = str(supp_id)
-            split = string_id.split('\'')
-            if split[1] != '':
-                supp_ids_edited.append(int(split[1]))
-            else:
-                supp_ids_edited.append(np.NaN)
-        product_info_df['DSDSUPID'] = supp_ids_edited
-
-        # List of all DSDPID from list of Supplement IDs
-        supp_DSDPIDs = {}
-        for seqn in supp_for_each_SEQN:
-            if supp_for_each_SEQN[seqn] == []:
-                supp_for_each_SEQN.pop(seqn)
-        for seqn in supp_for_each_SEQN:
-            list_supp_id = supp_for_each_SEQN[seqn]
-            dsdpids = DSDPIDs_from_supp_IDs(list_supp_id, product_info_df)
-            if dsdpids != []:
-                supp_DSDPIDs[seqn] = dsdpids
-    else:
-        # for each SEQN, get a list of supplement IDs
-        supp_DSDPIDs = {}
-        for seqn in data_df['SEQN'].unique():
-            df_with_only_seqn = data_df[data_df['SEQN'] == seqn]
-            supp_ids = list(df_with_only_seqn['DSDPID'])
-            supp_ids = [supp_id for supp_id in supp_ids if (1 < supp_id and supp_id < 19767)]
-            if supp_ids != []:
-                supp_DSDPIDs[seqn] = supp_ids
-    
-    # Ingredient cats for each SEQN
-    ing_cats_SEQN = {}
-    for seqn in supp_DSDPIDs:
-        list_supp_DSDPIDs = supp_DSDPIDs[seqn]
-        seqn_ing_cats = ing_cats_for_SEQN(list_supp_DSDPIDs, ingredient_info_df)
-        ing_cats_SEQN[seqn] = seqn_ing_cats
-
-    columns = {'SEQN': list(ing_cats_SEQN.keys()), 'Ingredient1_Vitamin': [],\
-        'Ingredient2_Mineral': [], 'Ingredient3_Botanical': [],\
-                'Ingredient4_Other': [], 'Ingredient5_Amino_Acid': []}
-    for seqn in ing_cats_SEQN:
-        ing_cats = ing_cats_SEQN[seqn]
-        for ing_cat in ing_cats:
-            for column in columns.keys():
-                if str(ing_cat) in column:
-                    columns[column].append(ing_cats[ing_cat])
-        
-    df = pd.DataFrame(columns)
-    return df    
+    if specs is None:
+        specs = repeated_seqn_aggregations
+    dfs = []
+    for spec in specs:
+        spec_cols = lambda col, spec=spec: re.match(spec['columns'], col) is not None
+        for xpt_loc in repeated_seqn_files(year, spec):
+            df = aggregate_xpt_long_to_wide(xpt_loc, key=spec['key'], group_cols=spec['group_cols'],\
+                columns=spec_cols, reductions=spec['reductions'], keys_to_keep=seqns)
+            df.index.name = 'SEQN'
+            dfs.append(df)
+    if dfs == []:
+        return pd.DataFrame({'SEQN': []})
+    df = pd.concat(dfs, axis=1, join='outer', sort=True)
+    df = df.reset_index()
+    return df
 
 def complete_df(year:str)->pd.DataFrame:
     """Returns the "complete" dataframe for a given year. This contains dataframes
     for every data file that does not have multiple rows for a SEQN as well as 
-    two other separate dataframes containing information on patients' dietary
-    supplements and prescription meds.
+    three other separate dataframes containing information on patients' dietary
+    supplements, prescription meds and the aggregates of other files with repeated SEQN.
 
     Args:
         year (str): '1999-2000', '2001-2002', ..., '2017-2018'
@@ -659,66 +1143,455 @@ def complete_df(year:str)->pd.DataFrame:
     df_pres_meds_file = os.path.join(root_loc,\
         'pres_meds_df', year + '_pres_meds_df.pkl')
     df_pres_meds = pd.read_pickle(df_pres_meds_file)
+    df_repeated_seqn_file = os.path.join(root_loc,\
+        'repeated_seqn_dfs', year + '_repeated_seqn_df.pkl')
+    df_repeated_seqn = pd.read_pickle(df_repeated_seqn_file)
 
     df = df_without_rep_seqn.merge(df_dietary_supp, on='SEQN',\
         how='outer', sort=True)
     df = df.merge(df_pres_meds, on='SEQN', how='outer', sort=True)
+    df = df.merge(df_repeated_seqn, on='SEQN', how='outer', sort=True)
     return df
 
+# 2.3 Compact dtypes before persisting dataframes: NHANES answers are small integer codes
+#     and every column comes out of the data files as float64
+compacted_int_dtypes = [('Int8', np.int8), ('Int16', np.int16), ('Int32', np.int32)]
+
+def compact_dtypes(df:pd.DataFrame, cols_analysis_df:pd.DataFrame=None)->pd.DataFrame:
+    """Returns a dataframe where float64 (and nullable Float32/Float64) columns are stored 
+    in smaller dtypes without losing any values. Columns of whole numbers (codes) become the smallest nullable 
+    integer dtype (Int8, Int16, Int32) and other columns become float32 where every 
+    value survives the conversion. CONTINUOUS columns in cols_analysis_df are never 
+    turned into integers. SEQN is left as it is.
+
+    Args:
+        df (pd.DataFrame): dataframe to compact
+        cols_analysis_df (pd.DataFrame, optional): analysis of columns with the 
+        'Feature_Col_Name' and 'Feature_Col_Dtype' of each column. Defaults to None
+        (infer from the values).
+
+    Returns:
+        pd.DataFrame: dataframe with compacted dtypes
+    """
+    col_dtypes = {}
+    if cols_analysis_df is not None:
+        col_dtypes = dict(zip(cols_analysis_df['Feature_Col_Name'], cols_analysis_df['Feature_Col_Dtype']))
+
+    new_dtypes = {}
+    for col in df.columns:
+        # nullable Float32/Float64 columns come from concatenating dataframes compacted differently
+        if (col == 'SEQN') or (str(df[col].dtype) not in ['float64', 'Float32', 'Float64']):
+            continue
+        values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        known_values = values[~np.isnan(values)]
+        is_whole = np.array_equal(known_values, np.round(known_values))
+        if is_whole and (col_dtypes.get(col) != 'CONTINUOUS'):
+            for int_dtype, np_int_dtype in compacted_int_dtypes:
+                int_info = np.iinfo(np_int_dtype)
+                if (len(known_values) == 0) or ((int_info.min <= known_values.min()) and\
+                    (known_values.max() <= int_info.max)):
+                    new_dtypes[col] = int_dtype
+                    break
+        if (col not in new_dtypes) and \
+            np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True):
+            new_dtypes[col] = 'float32'
+        if (col not in new_dtypes) and (df[col].dtype != np.float64):
+            new_dtypes[col] = 'float64'
+    return df.astype(new_dtypes)
+
+def widen_compacted_dtypes(df:pd.DataFrame)->pd.DataFrame:
+    """Returns a dataframe where compacted columns (see compact_dtypes) are float64 
+    again, with NaN for missing values. Used by code that compares values one at a 
+    time and expects NaN rather than pd.NA. Concatenating years compacted differently
+    gives nullable Float32/Float64 columns, which are widened too (every nullable 
+    numeric dtype is).
+
+    Args:
+        df (pd.DataFrame): dataframe with compacted dtypes
+
+    Returns:
+        pd.DataFrame: dataframe with float64 columns
+    """
+    return df.astype({col: 'float64' for col in df.columns if (df[col].dtype == np.float32) or\
+        (pd.api.types.is_extension_array_dtype(df[col].dtype) and pd.api.types.is_numeric_dtype(df[col].dtype))})
+
+# 2.4 Incremental builds: every dataframe stored by main.py keeps a record of the fingerprint
+#     of its inputs (contents of input files, parameters and the source code of the functions
+#     that build it), so that re-runs only rebuild dataframes whose inputs changed
+# Module-level values that hold the state of the running process rather than settings
+process_state_names = ['loaded_xpt_catalogs', 'loaded_ingredient_cat_masks']
+
+def code_version(functions:list)->str:
+    """Returns a hash of the source code of the functions and of every function of this
+    module they use, directly or indirectly. Module-level values they use (e.g. 
+    drug_class_names) are part of the hash too.
+
+    Args:
+        functions (list): list of functions
+
+    Returns:
+        str: hex digest of the source code
+    """
+    sources = {}
+    functions_to_visit = list(functions)
+    while functions_to_visit:
+        function = functions_to_visit.pop()
+        function = getattr(function, '__wrapped__', function)
+        if function.__name__ in sources:
+            continue
+        sources[function.__name__] = inspect.getsource(function)
+        # Names used by the function, including inside its lambdas and comprehensions
+        code_objects = [function.__code__]
+        names = set()
+        while code_objects:
+            code = code_objects.pop()
+            names.update(code.co_names)
+            code_objects.extend([const for const in code.co_consts if inspect.iscode(const)])
+        for name in names:
+            value = function.__globals__.get(name)
+            if inspect.isfunction(getattr(value, '__wrapped__', value)) and\
+                (getattr(value, '__module__', None) == function.__module__):
+                functions_to_visit.append(value)
+            elif isinstance(value, (dict, list, tuple, str, int, float)) and (name not in sources) and\
+                (name not in process_state_names):
+                sources[name] = repr(value)
+    sha1 = hashlib.sha1()
+    for name in sorted(sources):
+        sha1.update(name.encode())
+        sha1.update(sources[name].encode())
+    return sha1.hexdigest()
+
+def build_fingerprint(input_files:list, params:dict, functions:list)->str:
+    """Returns the fingerprint of everything a dataframe is built from.
+
+    Args:
+        input_files (list): files the dataframe is built from
+        params (dict): parameters the dataframe is built with (must be JSON serializable)
+        functions (list): functions that build the dataframe
+
+    Returns:
+        str: hex digest of the fingerprint
+    """
+    fingerprint = {'input_files': {str(file_loc): file_content_hash(file_loc) for file_loc in input_files},\
+        'params': params, 'code_version': code_version(functions)}
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+def build_if_stale(output_path:str, build_df, input_files:list=None, params:dict=None,\
+    functions:list=None)->bool:
+    """Builds the dataframe stored at output_path, unless it was already built from the
+    same inputs. The fingerprint of the inputs is recorded next to the pickle file in 
+    '<output_path>.build.json'.
+
+    Args:
+        output_path (str): location of the pickle file
+        build_df (callable): function without arguments that returns the dataframe
+        input_files (list, optional): files the dataframe is built from. Defaults to None.
+        params (dict, optional): parameters the dataframe is built with. Defaults to None.
+        functions (list, optional): functions that build the dataframe. Defaults to None.
+
+    Returns:
+        bool: True if the dataframe was (re)built and False if it was up to date
+    """
+    fingerprint = build_fingerprint(input_files or [], params or {}, functions or [])
+    record_path = output_path + '.build.json'
+    if os.path.isfile(output_path) and os.path.isfile(record_path):
+        with open(record_path, 'r') as f:
+            if json.load(f)['fingerprint'] == fingerprint:
+                print('{} is up to date.'.format(output_path))
+                return False
+
+    df = build_df()
+    if os.path.dirname(output_path) != '':
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    df.to_pickle(output_path)
+    with open(record_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint}, f)
+    return True
+
+# 2.5 Parallel year bracket builds: the year brackets do not depend on each other until the
+#     master dataframe is created, so each one is built by its own process
+def year_bracket_df_files(year:str)->dict:
+    """Returns the locations of the dataframes stored for a year bracket.
+
+    Args:
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
+
+    Returns:
+        dict: locations of the eligible SEQN, merged, prescription medications, dietary 
+        supplement, repeated SEQN aggregates and complete dataframes of the year bracket
+    """
+    return {'eligible_seqn': os.path.join(root_loc, 'eligible_seqn_dfs', year + '_eligible_seqn_df.pkl'),\
+        'year_df': os.path.join(root_loc, 'dfs_without_repeated_seqn_updated', year + '_df.pkl'),\
+        'pres_meds_df': os.path.join(root_loc, 'pres_meds_df', year + '_pres_meds_df.pkl'),\
+        'dietary_supp_df': os.path.join(root_loc, 'dietary_supplements_dfs', year + '_dietary_supp_df.pkl'),\
+        'repeated_seqn_df': os.path.join(root_loc, 'repeated_seqn_dfs', year + '_repeated_seqn_df.pkl'),\
+        'complete_df': os.path.join(root_loc, 'complete_year_dfs_updated', year + '_complete_df.pkl')}
+
+def build_year_bracket(year:str, root_cats:list, skip_files:list, class_names:dict=None)->str:
+    """Builds the stale dataframes of a year bracket: the SEQN meeting the cohort inclusion
+    criteria, then for these patients only the merged df of files without repeated SEQN, 
+    the prescription medications df, the dietary supplement df, the aggregates of other 
+    files with repeated SEQN and the complete df, each stored with compacted dtypes.
+
+    Args:
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
+        root_cats (list): list of root categories e.g. ['Demographic data', 'Dietary data'...]
+        skip_files (list): list of files with repeated SEQN
+        class_names (dict, optional): Drug Classes and their category codes.
+        Defaults to None (drug_class_names).
+
+    Returns:
+        str: location of the complete df of the year bracket
+    """
+    if class_names is None:
+        class_names = drug_class_names
+    df_files = year_bracket_df_files(year)
+    cols_analysis_file = os.path.join(root_loc, 'new_cols_analysis_df.xlsx')
+    cols_analysis_df = columns_analysis()['cols_analysis_df']
+
+    catalog = xpt_catalog()
+    year_files = catalog.loc[(catalog['year'] == year) & (catalog['root_cat'].isin(root_cats)), 'path']
+    year_skip_files = sorted([f for f in skip_files if year in f])
+    # Patients meeting the cohort inclusion criteria, found from the cohort driver columns only;
+    # every other file is only read for these patients
+    build_if_stale(df_files['eligible_seqn'],\
+        lambda: eligible_seqn(year, root_cats, skip_files),\
+        input_files=list(year_files),\
+        params={'year': year, 'root_cats': root_cats, 'skip_files': year_skip_files},\
+        functions=[eligible_seqn])
+    eligible = lambda: pd.read_pickle(df_files['eligible_seqn'])['SEQN']
+
+    build_if_stale(df_files['year_df'],\
+        lambda: compact_dtypes(merge_data_for_one_year_bracket(root_cats, year, skip_files=skip_files,\
+            seqns=eligible()), cols_analysis_df),\
+        input_files=list(year_files) + [df_files['eligible_seqn'], cols_analysis_file],\
+        params={'year': year, 'root_cats': root_cats, 'skip_files': year_skip_files},\
+        functions=[merge_data_for_one_year_bracket, compact_dtypes])
+
+    print('Creating {} prescription medications df.'.format(year))
+    build_if_stale(df_files['pres_meds_df'],\
+        lambda: compact_dtypes(updated_pres_meds_df(year, class_names, seqns=eligible()), cols_analysis_df),\
+        input_files=pres_meds_files(year) + [df_files['eligible_seqn'], cols_analysis_file],\
+        params={'year': year, 'drug_class_names': class_names},\
+        functions=[updated_pres_meds_df, compact_dtypes])
+
+    print('Creating {} dietary supplement df.'.format(year))
+    build_if_stale(df_files['dietary_supp_df'],\
+        lambda: compact_dtypes(diet_supp_df(year, seqns=eligible()), cols_analysis_df),\
+        input_files=diet_supp_files(year) + [df_files['eligible_seqn'], cols_analysis_file],\
+        params={'year': year},\
+        functions=[diet_supp_df, compact_dtypes])
+
+    print('Creating {} repeated SEQN aggregates df.'.format(year))
+    build_if_stale(df_files['repeated_seqn_df'],\
+        lambda: compact_dtypes(repeated_seqn_df(year, seqns=eligible()), cols_analysis_df),\
+        input_files=sum([repeated_seqn_files(year, spec) for spec in repeated_seqn_aggregations], [])\
+            + [df_files['eligible_seqn'], cols_analysis_file],\
+        params={'year': year},\
+        functions=[repeated_seqn_df, compact_dtypes])
+
+    print('Creating complete {} df.'.format(year))
+    build_if_stale(df_files['complete_df'],\
+        lambda: compact_dtypes(complete_df(year), cols_analysis_df),\
+        input_files=[df_files['year_df'], df_files['dietary_supp_df'], df_files['pres_meds_df'],\
+            df_files['repeated_seqn_df'], cols_analysis_file],\
+        params={'year': year},\
+        functions=[complete_df, compact_dtypes])
+    return df_files['complete_df']
+
+def year_bracket_memory_estimate(year:str, root_cats:list, skip_files:list, memory_per_data_byte:int=4,\
+    chunksize:int=100000)->int:
+    """Returns an estimate of the peak memory used to build a year bracket, from the sizes
+    of its data files in the XPT catalog. Files that are read whole (the files merged for 
+    the year bracket, prescription medications and dietary supplements) are read, merged 
+    and compacted, which holds a few copies of their data at once. Files aggregated by
+    repeated_seqn_df are read in chunks, so only one chunk of the largest of them counts.
+    Other files with repeated SEQN are not read.
+
+    Args:
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
+        root_cats (list): list of root categories e.g. ['Demographic data', 'Dietary data'...]
+        skip_files (list): list of files with repeated SEQN
+        memory_per_data_byte (int, optional): bytes of memory per byte of data file. Defaults to 4.
+        chunksize (int, optional): number of rows per chunk of aggregated files. Defaults to 100000.
+
+    Returns:
+        int: estimated peak memory in bytes
+    """
+    catalog = xpt_catalog()
+    catalog = catalog[catalog['year'] == year]
+    whole_files = set(catalog.loc[catalog['root_cat'].isin(root_cats) & ~catalog['path'].isin(skip_files), 'path'])
+    whole_files.update(pres_meds_files(year))
+    whole_files.update([f for f in dietary_supplement_file_paths() if year in f])
+    whole_files.update(catalog.loc[catalog['path'].str.contains('Dietary Supplement Database', regex=False), 'path'])
+    streamed_files = set([f for spec in repeated_seqn_aggregations for f in repeated_seqn_files(year, spec)])
+
+    whole_size = int(catalog.loc[catalog['path'].isin(whole_files), 'size'].sum())
+    streamed = catalog[catalog['path'].isin(streamed_files) & (catalog['num_rows'] > 0)]
+    chunk_size = int((streamed['size'] / streamed['num_rows']).max() * chunksize) if len(streamed) else 0
+    return (whole_size + chunk_size) * memory_per_data_byte
+
+def available_memory()->int:
+    """Returns the memory currently available on the machine, in bytes.
+
+    Returns:
+        int: available memory in bytes (None if it cannot be determined)
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def year_bracket_workers(years:list, root_cats:list, skip_files:list, memory_budget:int=None,\
+    max_workers:int=None)->int:
+    """Returns the number of year brackets that can be built at the same time without the
+    estimated memory of the largest year brackets exceeding the memory budget.
+
+    Args:
+        years (list): list of year brackets
+        root_cats (list): list of root categories e.g. ['Demographic data', 'Dietary data'...]
+        skip_files (list): list of files with repeated SEQN
+        memory_budget (int, optional): memory in bytes that the builds may use together.
+        Defaults to None (half of the available memory).
+        max_workers (int, optional): highest number of processes. Defaults to None (all cores).
+
+    Returns:
+        int: number of processes
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if memory_budget is None:
+        memory = available_memory()
+        memory_budget = memory // 2 if memory is not None else None
+    num_workers = min(max_workers, len(years))
+    if memory_budget is not None:
+        # The largest year brackets can all be running at the same time
+        estimates = sorted([year_bracket_memory_estimate(year, root_cats, skip_files) for year in years],\
+            reverse=True)
+        while (num_workers > 1) and (sum(estimates[:num_workers]) > memory_budget):
+            num_workers -= 1
+    return max(num_workers, 1)
+
+def build_year_brackets_in_parallel(years:list, root_cats:list, skip_files:list, class_names:dict=None,\
+    max_workers:int=None, memory_budget:int=None)->dict:
+    """Builds the stale dataframes of every year bracket in a pool of processes. The largest
+    year brackets are started first, so that the builds end close to the time of the
+    slowest year bracket.
+
+    Args:
+        years (list): list of year brackets
+        root_cats (list): list of root categories e.g. ['Demographic data', 'Dietary data'...]
+        skip_files (list): list of files with repeated SEQN
+        class_names (dict, optional): Drug Classes and their category codes.
+        Defaults to None (drug_class_names).
+        max_workers (int, optional): highest number of processes. Defaults to None (all cores).
+        memory_budget (int, optional): memory in bytes that the builds may use together.
+        Defaults to None (half of the available memory).
+
+    Returns:
+        dict: location of the complete df of each year bracket
+    """
+    num_workers = year_bracket_workers(years, root_cats, skip_files, memory_budget, max_workers)
+    print('Building {} year brackets with {} processes.'.format(len(years), num_workers))
+    ordered_years = sorted(years, key=lambda year: year_bracket_memory_estimate(year, root_cats, skip_files),\
+        reverse=True)
+    if num_workers == 1:
+        complete_df_files = [build_year_bracket(year, root_cats, skip_files, class_names)\
+            for year in ordered_years]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            complete_df_files = list(executor.map(build_year_bracket, ordered_years,\
+                [root_cats]*len(years), [skip_files]*len(years), [class_names]*len(years)))
+    complete_df_files = dict(zip(ordered_years, complete_df_files))
+    return {year: complete_df_files[year] for year in years}
+
 # 3. Create a master dataframe containing the first occurrence of each patient
 #    in each year bracket's complete dataframe
-def combine_dfs(df1:pd.DataFrame, df2:pd.DataFrame)->pd.DataFrame:
-    """Combines two dataframes of different dimensions.
-
-    Args:
-        df1 (pd.DataFrame): first dataframe with all SEQN
-        df2 (pd.DataFrame): second dataframe with SEQN that aren't in df1
-
-    Returns:
-        pd.DataFrame: combined dataframe
-    """
-    # 1. Columns that are in both df1 and df2
-    common_cols = [col for col in list(df1.columns) if col in list(df2.columns)]
-    # 2. Create two dfs from df1 and df2 with only the common_cols
-    df1_common_cols = df1[common_cols]
-    df2_common_cols = df2[common_cols]
-    # 3. Create a central df and let it be the concatenation of the above
-    central_df = pd.concat([df1_common_cols, df2_common_cols], sort=False, ignore_index=True)
-    common_cols.remove('SEQN')
-    # 4. Create a df from df1 and df2 with the remaining columns that aren't common
-    #    that we now need to merge
-    df1_cols_to_merge = df1.drop(common_cols, axis = 1)
-    df2_cols_to_merge = df2.drop(common_cols, axis = 1)
-    # 5. Merge the dfs to the central_df
-    central_df = central_df.merge(df1_cols_to_merge, on='SEQN',\
-        how='outer', sort=True)
-    central_df = central_df.merge(df2_cols_to_merge, on='SEQN',\
-        how='outer', sort=True)
-    return central_df
+# Columns the cohort inclusion criteria are evaluated on
+cohort_driver_cols = ['LBXGLU', 'DIQ010', 'RIDAGEYR', 'RIAGENDR', 'URXPREG']
 
-def all_seqn_filters_applied(df:pd.DataFrame)->pd.DataFrame:
-    """Returns the dataframe after all SEQN filters are applied to it.
+def cohort_inclusion_mask(df:pd.DataFrame)->pd.Series:
+    """Returns which patients of a dataframe meet the cohort inclusion criteria: their
+    diabetes label can be classified, they are at least 20 years old and they are not 
+    pregnant. Only the cohort driver columns are used.
 
     Args:
-        df (DataFrame): dataframe before any filters are apply to the SEQN.
+        df (pd.DataFrame): dataframe containing the cohort driver columns
 
     Returns:
-        pd.DataFrame: dataframe after applying filters.
+        pd.Series: boolean mask of the patients to keep
     """
-    # 1. df that only stores SEQN whose diabetes label can be classified.
-    df1_ind = ~(df['LBXGLU'].isnull())
-    df2_ind = df['LBXGLU'].isnull() & df['DIQ010'] == 1
+    # Compare compacted columns as float64 so that missing values behave like NaN
+    filter_cols = widen_compacted_dtypes(df[cohort_driver_cols])
+    # 1. df that only stores SEQN whose diabetes label can be classified: glucose was measured,
+    #    or it wasn't and the patient answered DIQ010 (any answer but 0)
+    df1_ind = ~(filter_cols['LBXGLU'].isnull())
+    df2_ind = filter_cols['LBXGLU'].isnull() & filter_cols['DIQ010'].notnull() & (filter_cols['DIQ010'] != 0)
     df_ind = df1_ind | df2_ind
     # 2. Patient's Age >= 20
-    df = df[df_ind & (df['RIDAGEYR'] >= 20)] 
+    df_ind = df_ind & (filter_cols['RIDAGEYR'] >= 20)
     # 3. (Patient is not Female) OR (Patient is Female with negative Pregnancy Test)
     # instead of doing "not 1, not 3, and not 4"
-    df = df[(df['RIAGENDR'] != 2) | ((df['RIAGENDR'] == 2) & (df['URXPREG'] == 2))]
+    df_ind = df_ind & ((filter_cols['RIAGENDR'] != 2) |\
+        ((filter_cols['RIAGENDR'] == 2) & (filter_cols['URXPREG'] == 2)))
+    return df_ind
+
+def all_seqn_filters_applied(df:pd.DataFrame)->pd.DataFrame:
+    """Returns the dataframe after all SEQN filters are applied to it.
+
+    Args:
+        df (DataFrame): dataframe before any filters are apply to the SEQN.
+
+    Returns:
+        pd.DataFrame: dataframe after applying filters.
+    """
+    df = df[cohort_inclusion_mask(df)]
     return df
 
+def eligible_seqn(year:str, root_cats:list, skip_files:list)->pd.DataFrame:
+    """Returns the SEQN of a year bracket that meet the cohort inclusion criteria. Only the
+    cohort driver columns of the files that contain them are read, and they are combined 
+    the same way as when the whole year bracket is merged.
+
+    Args:
+        year (str): year bracket ('1999-2000', ..., '2017-2018')
+        root_cats (list): list of root categories e.g. ['Demographic data', 'Dietary data'...]
+        skip_files (list): list of files with repeated SEQN
+
+    Returns:
+        pd.DataFrame: df with the SEQN column of the eligible patients
+    """
+    catalog = xpt_catalog()
+    year_catalog = catalog[(catalog['year'] == year) & (catalog['root_cat'].isin(root_cats))]
+    files_without_driver_cols = [path for path, variables in zip(year_catalog['path'], year_catalog['variables'])\
+        if not set(variables) & set(cohort_driver_cols)]
+    driver_df = merge_data_for_one_year_bracket(root_cats, year, skip_files=list(skip_files) +\
+        files_without_driver_cols, columns=cohort_driver_cols)
+    for col in cohort_driver_cols:
+        if col not in driver_df.columns:
+            driver_df[col] = np.nan
+    return driver_df.loc[cohort_inclusion_mask(driver_df), ['SEQN']].reset_index(drop=True)
+
+def first_occurrence_masks(seqn_cols:list)->list:
+    """Returns, for each SEQN column, a mask of the rows whose SEQN does not appear in any
+    of the previous columns (or earlier in the same column), using one hash table for 
+    all columns.
+
+    Args:
+        seqn_cols (list): list of SEQN columns (pd.Series)
+
+    Returns:
+        list: list of boolean arrays
+    """
+    all_seqn = pd.concat(seqn_cols, ignore_index=True)
+    is_first_occurrence = ~all_seqn.duplicated(keep='first').to_numpy()
+    bounds = np.cumsum([0] + [len(seqn_col) for seqn_col in seqn_cols])
+    return [is_first_occurrence[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
 def create_master_df(years:list)->pd.DataFrame:
     """Returns a master dataframe containing info for patients across
-    all year brackets.
+    all year brackets. Patients are kept from the first year bracket
+    they appear in (after the SEQN filters).
 
     Args:
         years (list): list of year brackets. e.g. ['1999-2000', '2001-2002',...]
@@ -726,7 +1599,7 @@ def create_master_df(years:list)->pd.DataFrame:
     Returns:
         pd.DataFrame: master dataframe
     """
-    main_df = pd.DataFrame({})
+    year_dfs = []
     for year in years:
         print('Processing year: {}'.format(year))
         # 1. Read complete df for year 
@@ -734,24 +1607,95 @@ def create_master_df(years:list)->pd.DataFrame:
             year+'_complete_df.pkl')
         year_df = pd.read_pickle(year_file_path)
         # 2. Filter the seqn
-        year_df_after_seqn_filters = all_seqn_filters_applied(year_df)
-
-        if year == '1999-2000':
-            main_df = year_df_after_seqn_filters
-        # Create separate condition for these three year brackets since all SEQN are new, unique,
-        # and without overlap
-        elif year in ['2013-2014','2015-2016','2017-2018']:
-            main_df = combine_dfs(main_df, year_df_after_seqn_filters)
-        else:
-            # Create a df with only SEQN that aren't already in the main_df
-            seqn_to_append = [seqn for seqn in list(year_df_after_seqn_filters['SEQN'])
-                if seqn not in list(main_df['SEQN'])]
-            seqn_df = year_df_after_seqn_filters[year_df_after_seqn_filters['SEQN'].isin(seqn_to_append)]
-            # Combine both dfs of different dimensions
-            main_df = combine_dfs(main_df, seqn_df)
+        year_dfs.append(all_seqn_filters_applied(year_df))
+
+    # 3. Only keep the SEQN that aren't in an earlier year bracket (anti-join on SEQN)
+    masks = first_occurrence_masks([year_df['SEQN'] for year_df in year_dfs])
+    year_dfs = [year_df[mask] for year_df, mask in zip(year_dfs, masks)]
+    # 4. Stack the year brackets at once, aligning their columns
+    main_df = pd.concat(year_dfs, join='outer', sort=False, ignore_index=True)
+    main_df = main_df.sort_values('SEQN', kind='stable', ignore_index=True)
     return main_df
     
-def filtered_columns_df(df:pd.DataFrame, threshold:int)->pd.DataFrame:
+# Columns that are important - for filtering patients based on inclusion criteria and for 
+# Diabetes Classification - and are never dropped because of missing values
+important_cols = ['SEQN','RIAGENDR','RIDAGEYR','LBXGLU','URXPREG','DIQ010','DIQ160']
+
+def seqn_year_brackets(seqns:pd.Series, years:list)->pd.Series:
+    """Returns the year bracket of each patient of the master dataframe, i.e. the first
+    year bracket whose eligible SEQN contain it.
+
+    Args:
+        seqns (pd.Series): SEQN column of the master dataframe
+        years (list): list of year brackets. e.g. ['1999-2000', '2001-2002',...]
+
+    Returns:
+        pd.Series: year bracket of each patient, aligned with seqns
+    """
+    year_of_seqn = pd.concat([pd.read_pickle(year_bracket_df_files(year)['eligible_seqn'])['SEQN']\
+        .to_frame().assign(year=year) for year in years], ignore_index=True)
+    year_of_seqn = year_of_seqn.drop_duplicates('SEQN', keep='first').set_index('SEQN')['year']
+    return seqns.map(year_of_seqn)
+
+def missingness_profile(df:pd.DataFrame, year_brackets:pd.Series)->pd.DataFrame:
+    """Returns the number of rows and of missing values of each column of a dataframe per
+    year bracket, computed in one pass. The missingness of any column over any set of 
+    year brackets can be derived from it without reading the dataframe again.
+
+    Args:
+        df (pd.DataFrame): dataframe e.g. master dataframe
+        year_brackets (pd.Series): year bracket of each row of df
+
+    Returns:
+        pd.DataFrame: one row per year bracket with the number of rows ('N_ROWS') and the
+        number of missing values of each column
+    """
+    year_brackets = pd.Series(year_brackets.to_numpy(), index=df.index)
+    profile = df.isnull().groupby(year_brackets).sum()
+    profile.insert(0, 'N_ROWS', year_brackets.groupby(year_brackets).size())
+    return profile
+
+def missingness_rates(profile:pd.DataFrame, years:list=None)->pd.Series:
+    """Returns the fraction of missing values of each column over some year brackets.
+
+    Args:
+        profile (pd.DataFrame): missingness profile
+        years (list, optional): year brackets, e.g. ['2003-2004', ..., '2013-2014']. 
+        Defaults to None (all year brackets).
+
+    Returns:
+        pd.Series: fraction of missing values of each column
+    """
+    if years is not None:
+        profile = profile.loc[profile.index.isin(years)]
+    totals = profile.sum()
+    return totals.drop('N_ROWS') / totals['N_ROWS']
+
+def columns_below_threshold(rates:pd.Series, thresholds:list)->dict:
+    """Returns the columns to keep for each threshold: the important columns and the columns
+    whose fraction of missing values is below the threshold. The rates are sorted once, so 
+    each threshold is a binary search.
+
+    Args:
+        rates (pd.Series): fraction of missing values of each column (from missingness_rates)
+        thresholds (list): thresholds for highest % NaN values a column can have
+
+    Returns:
+        dict: list of columns to keep (in the order of rates) for each threshold
+    """
+    order = np.argsort(rates.to_numpy(), kind='stable')
+    sorted_rates = rates.to_numpy()[order]
+    col_names = rates.index.to_numpy()
+    is_important = rates.index.isin(important_cols)
+    cols_to_keep = {}
+    for threshold in thresholds:
+        keep = is_important.copy()
+        keep[order[:np.searchsorted(sorted_rates, threshold, side='left')]] = True
+        cols_to_keep[threshold] = col_names[keep].tolist()
+    return cols_to_keep
+
+def filtered_columns_df(df:pd.DataFrame, threshold:int, profile:pd.DataFrame=None,\
+    years:list=None)->pd.DataFrame:
     """Returns a filtered df containing only variables available and continuous
     across all year brackets and with less than 50% missing values.
 
@@ -759,60 +1703,92 @@ def filtered_columns_df(df:pd.DataFrame, threshold:int)->pd.DataFrame:
         df (pd.DataFrame): dataframe
         threshold (int): threshold for highest % NaN values a column can have without
         getting dropped
+        profile (pd.DataFrame, optional): missingness profile of df. Defaults to None 
+        (the missing values of df are counted).
+        years (list, optional): year brackets the missing values are counted over, only 
+        with a profile. Defaults to None (all year brackets).
 
     Returns:
         pd.DataFrame: filtered df containing fewer columns
     """
-    # Specifies columns that are important - for filtering patients based on inclusion
-    # criteria and for Diabetes Classification
-    important_cols = ['SEQN','RIAGENDR','RIDAGEYR','LBXGLU','URXPREG','DIQ010','DIQ160']
-    cols_to_keep = []
-    for column in df.columns:
-        if column in important_cols:
-            cols_to_keep.append(column)
-        else:
-            # 3. Filters based on % of NaN vals in column
-            if df[column].isnull().sum()/len(df) < threshold:
-                cols_to_keep.append(column)
+    # 3. Filters based on % of NaN vals in column
+    if profile is None:
+        rates = df.isnull().mean()
+    else:
+        rates = missingness_rates(profile, years).reindex(df.columns)
+    cols_to_keep = columns_below_threshold(rates, [threshold])[threshold]
     condensed_df = df[cols_to_keep]
     return condensed_df
 
 # 4. Assign Diabetes Class Label
-def assign_diabetes_class_labels(df:pd.DataFrame)->pd.DataFrame:
+# Rule sets for the diabetes classification label: the columns they use and, in order of
+# priority, each label with the condition patients must meet to get it (0 otherwise)
+diabetes_labeling_rules = {
+    # Plasma glucose and the answer to "Have you ever been told by a doctor that you have 
+    # diabetes?" - consistent with classification criteria used in the BMC article
+    'glucose': {'cols': ['LBXGLU', 'DIQ010'], 'rules': [\
+        (1, lambda df: (df['LBXGLU'] >= 126) | (df['DIQ010'] == 1)),\
+        (2, lambda df: (df['LBXGLU'] > 100) & (df['LBXGLU'] < 126))]},
+    # Same as 'glucose' with HbA1c (%) added: >= 6.5 is diabetic and 5.7 to 6.4 is prediabetic
+    'glucose_hba1c': {'cols': ['LBXGLU', 'DIQ010', 'LBXGH'], 'rules': [\
+        (1, lambda df: (df['LBXGLU'] >= 126) | (df['DIQ010'] == 1) | (df['LBXGH'] >= 6.5)),\
+        (2, lambda df: ((df['LBXGLU'] > 100) & (df['LBXGLU'] < 126)) |\
+            ((df['LBXGH'] >= 5.7) & (df['LBXGH'] < 6.5)))]}}
+
+def diabetes_class_labels(df:pd.DataFrame, rule_set:str='glucose')->tuple:
+    """Returns the diabetes classification label of every patient, evaluated for all
+    patients at once, and the number of patients with each label. Rule columns must be
+    numeric; Categorical rule columns are turned back into numbers.
+
+    Args:
+        df (pd.DataFrame): DataFrame with patients that fit the inclusion criteria.
+        rule_set (str, optional): name of the rule set in diabetes_labeling_rules. 
+        Defaults to 'glucose'.
+
+    Returns:
+        tuple: labels (pd.Series aligned with df: 0 non-diabetic, 1 diabetic, 2 prediabetic)
+        and number of patients with each label (pd.Series)
+    """
+    rules = diabetes_labeling_rules[rule_set]
+    # Compare compacted columns as float64 so that missing values behave like NaN
+    label_cols = widen_compacted_dtypes(df[rules['cols']])
+    # Categorical rule columns (see convert_cat_cols_to_categorical) hold the string form of 
+    # their values; compare them as numbers
+    for col in rules['cols']:
+        if isinstance(label_cols[col].dtype, pd.CategoricalDtype):
+            label_cols[col] = pd.to_numeric(label_cols[col].astype(object))
+    non_numeric_cols = [col for col in rules['cols'] if not pd.api.types.is_numeric_dtype(label_cols[col])]
+    if non_numeric_cols:
+        raise ValueError('Diabetes labeling rule columns must be numeric: {}'.format(non_numeric_cols))
+    conditions = [condition(label_cols).to_numpy(dtype=bool) for label, condition in rules['rules']]
+    labels = np.select(conditions, [label for label, condition in rules['rules']], default=0)
+    counts = pd.Series(np.bincount(labels, minlength=3), name='count')
+    counts.index.name = 'Diabetes_Class_Label'
+    return pd.Series(labels, index=df.index, name='Diabetes_Class_Label'), counts
+
+def assign_diabetes_class_labels(df:pd.DataFrame, rule_set:str='glucose')->pd.DataFrame:
     """Returns a df with an added column for the diabetes classification
     label using plasma glucose levels and the patient's answer to the
     question "Have you ever been told by a doctor that you have diabetes?"
     This is consistent with classification criteria used in the BMC article -
-    could include other measures such as the column 'LBXGH' (HbA1c) 
+    could include other measures such as the column 'LBXGH' (HbA1c) with 
+    rule_set='glucose_hba1c'
 
     Args:
         df (pd.DataFrame): DataFrame with patients that fit the inclusion
         criteria.
+        rule_set (str, optional): name of the rule set in diabetes_labeling_rules. 
+        Defaults to 'glucose'.
 
     Returns:
         pd.DataFrame: DataFrame with patients that fit the inclusion criteria
         with an additional column for their diabetes classification label
     """
-    # dataframe with the important columns used for classification
-    df_with_imp_cols = df[['SEQN','LBXGLU','DIQ010']]
-    diabetic = df_with_imp_cols[(df_with_imp_cols['LBXGLU'] >= 126) |\
-        (df_with_imp_cols['DIQ010'] == 1)]
-    prediabetic = df_with_imp_cols[(df_with_imp_cols['LBXGLU'] > 100) &\
-        (df_with_imp_cols['LBXGLU'] < 126)]
-
-    dict_of_seqn_and_class_label = {}
-    for seqn in list(df['SEQN']):
-        if seqn in list(diabetic['SEQN']):
-            dict_of_seqn_and_class_label[seqn] = 1
-        elif seqn in list(prediabetic['SEQN']):
-            dict_of_seqn_and_class_label[seqn] = 2
-        else:
-            dict_of_seqn_and_class_label[seqn] = 0
-    
-    df['Diabetes_Class_Label'] = list(dict_of_seqn_and_class_label.values())
+    labels, _ = diabetes_class_labels(df, rule_set)
+    df['Diabetes_Class_Label'] = labels
     # drop columns used for classification so they don't show up as being
     # very highly correlated with the target label
-    df = df.drop(columns=['LBXGLU', 'DIQ010'])
+    df = df.drop(columns=diabetes_labeling_rules[rule_set]['cols'])
     return df
 
 # 5. Purely Data Driven Approach
@@ -830,64 +1806,204 @@ def convert_object_cols_to_str(df:pd.DataFrame, object_cols:list)->pd.DataFrame:
         pd.DataFrame: dataframe where object dtype columns are converted to string.
     """
     for col in object_cols:
-        new_object_vals = []
-        object_vals = list(df[col])
-        for object_val in object_vals:
-            if isinstance(object_val, float) or object_val == b'': # if object_val is a float (if its nan)
-                new_object_vals.append(np.NaN)
-            else:
-                new_object_vals.append(str(object_val).split('\'')[1])
-        df[col] = new_object_vals
+        df[col] = decode_byte_strings(df[col])
     return df 
 
 # 5.1 Create Excel sheet for analysis of columns and their properties
-cols_analysis_file_path = os.path.join(root_loc, 'new_cols_analysis_df.xlsx')
-cols_analysis_df = pd.read_excel(cols_analysis_file_path)
-cols_analysis_df = cols_analysis_df.drop(cols_analysis_df.columns[0], axis=1)
-# keep if Is_Relevant? is NaN or == 'Irrelevant'
-relevant_cols_df1 = cols_analysis_df[cols_analysis_df['Is_Relevant?'].isnull()]
-relevant_cols_df2 = cols_analysis_df[cols_analysis_df['Is_Relevant?'] == 'Irrelevant']
-relevant_cols_df = pd.concat([relevant_cols_df1, relevant_cols_df2])
-all_relevant_cols = list(relevant_cols_df['Feature_Col_Name'])
-# group based on which features are continuous, categorical, and mixed
-cont_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'CONTINUOUS']
-all_continuous_cols = list(cont_df['Feature_Col_Name'])
-cat_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'CAT']
-all_cat_cols = list(cat_df['Feature_Col_Name'])
-mixed_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'MIX']
-all_mixed_cols = list(mixed_df['Feature_Col_Name'])
-object_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'OBJECT']
-all_object_cols = list(object_df['Feature_Col_Name'])
-
-# 5.2 Categorical columns 
-def convert_cat_col_vals_to_str(df:pd.DataFrame, cat_cols:list)->pd.DataFrame:
-    """Returns a dataframe where the dtype of categorical columns is converted
-    to string.
+@lru_cache(maxsize=None)
+def columns_analysis()->dict:
+    """Returns the analysis of columns and their properties from 'new_cols_analysis_df.xlsx'
+    and the lists of relevant columns grouped by dtype. Computed on first use and cached.
+
+    Returns:
+        dict: dict with cols_analysis_df, all_relevant_cols, all_continuous_cols, 
+        all_cat_cols, all_mixed_cols and all_object_cols
+    """
+    cols_analysis_file_path = os.path.join(root_loc, 'new_cols_analysis_df.xlsx')
+    cols_analysis_df = pd.read_excel(cols_analysis_file_path)
+    cols_analysis_df = cols_analysis_df.drop(cols_analysis_df.columns[0], axis=1)
+    # keep if Is_Relevant? is NaN or == 'Irrelevant'
+    relevant_cols_df1 = cols_analysis_df[cols_analysis_df['Is_Relevant?'].isnull()]
+    relevant_cols_df2 = cols_analysis_df[cols_analysis_df['Is_Relevant?'] == 'Irrelevant']
+    relevant_cols_df = pd.concat([relevant_cols_df1, relevant_cols_df2])
+    all_relevant_cols = list(relevant_cols_df['Feature_Col_Name'])
+    # group based on which features are continuous, categorical, and mixed
+    cont_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'CONTINUOUS']
+    all_continuous_cols = list(cont_df['Feature_Col_Name'])
+    cat_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'CAT']
+    all_cat_cols = list(cat_df['Feature_Col_Name'])
+    mixed_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'MIX']
+    all_mixed_cols = list(mixed_df['Feature_Col_Name'])
+    object_df = relevant_cols_df[relevant_cols_df['Feature_Col_Dtype'] == 'OBJECT']
+    all_object_cols = list(object_df['Feature_Col_Name'])
+    return {'cols_analysis_df': cols_analysis_df, 'all_relevant_cols': all_relevant_cols,\
+        'all_continuous_cols': all_continuous_cols, 'all_cat_cols': all_cat_cols,\
+        'all_mixed_cols': all_mixed_cols, 'all_object_cols': all_object_cols}
+
+# 5.2 Categorical columns - stored as pandas Categorical with a fixed vocabulary per column, kept
+# in a json file, so that a category has the same code whenever the data is prepared again
+def category_sort_key(category:str)->tuple:
+    """Returns the key that orders categories: numbers by value first, then other strings.
+
+    Args:
+        category (str): string form of a category
+
+    Returns:
+        tuple: sort key
+    """
+    try:
+        return (0, float(category), category)
+    except ValueError:
+        return (1, 0.0, category)
+
+def categorical_vocabularies(df:pd.DataFrame, cat_cols:list, vocabularies_file:str)->dict:
+    """Returns the vocabulary (string form of every category, in a fixed order) of each 
+    categorical column. Vocabularies already in vocabularies_file are reused unchanged;
+    columns without one get a vocabulary from their values in df, which is then added 
+    to the file. Values of df missing from an existing vocabulary are reported, since 
+    they become missing values; delete the file to build the vocabularies again.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the categorical columns
+        cat_cols (list): categorical columns
+        vocabularies_file (str): json file with the vocabularies of categorical columns
+
+    Returns:
+        dict: dict of categorical column names and their vocabularies
+    """
+    vocabularies = {}
+    if os.path.exists(vocabularies_file):
+        with open(vocabularies_file) as f:
+            vocabularies = json.load(f)
+    new_cols = [col for col in cat_cols if col not in vocabularies]
+    for col in cat_cols:
+        categories = {str(value) for value in pd.unique(df[col].dropna())}
+        if col in new_cols:
+            vocabularies[col] = sorted(categories, key=category_sort_key)
+        elif not categories.issubset(vocabularies[col]):
+            print('WARNING: values of {} not in its vocabulary in {} become missing values: {}'.format(col,\
+                vocabularies_file, sorted(categories.difference(vocabularies[col]), key=category_sort_key)))
+    if new_cols:
+        with open(vocabularies_file, 'w') as f:
+            json.dump(vocabularies, f, indent=1)
+    return {col: vocabularies[col] for col in cat_cols}
+
+def convert_cat_cols_to_categorical(df:pd.DataFrame, cat_cols:list, vocabularies:dict)->pd.DataFrame:
+    """Returns a dataframe where categorical columns are pandas Categorical with the
+    categories of their vocabulary. Only the distinct values of a column are converted 
+    to strings; values that are not in the vocabulary become missing values.
 
     Args:
-        df (pd.DataFrame): DataFrame with categorical column values not being string
-        cat_cols (list): Categorical columns whose values are to be converted to strings
+        df (pd.DataFrame): DataFrame with categorical columns
+        cat_cols (list): categorical columns to convert
+        vocabularies (dict): vocabularies of the columns (see categorical_vocabularies)
 
     Returns:
-        pd.DataFrame: dataframe where the dtype of categorical columns is converted
-        to string.
+        pd.DataFrame: dataframe where categorical columns are pandas Categorical
     """
     for col in cat_cols:
-        str_cat_vals = []
-        cat_vals = list(df[col])
-        for cat_val in cat_vals:
-            if pd.isnull(cat_val):
-                str_cat_vals.append(cat_val)
-            else:
-                str_cat_vals.append(str(cat_val))
-        df[col] = str_cat_vals
+        value_codes, values = pd.factorize(df[col])
+        categories = pd.Index(vocabularies[col])
+        # -1 (missing value) is appended so that missing values keep the code -1
+        codes = np.append(categories.get_indexer([str(value) for value in values]), -1)
+        df[col] = pd.Categorical.from_codes(codes[value_codes], categories=categories)
     return df
 
-# 5.2.1 Encode mixed columns and turn them into categorical columns - might need to add to this 
+def categorical_codes(X:pd.DataFrame)->np.ndarray:
+    """Returns the category codes of Categorical columns, -1 for missing values. Used
+    as the first step of the categorical transformation pipelines.
+
+    Args:
+        X (pd.DataFrame): DataFrame of Categorical columns
+
+    Returns:
+        np.ndarray: category codes (one column per categorical column)
+    """
+    return np.column_stack([X[col].cat.codes.to_numpy() for col in X.columns])
+
+def one_hot_feature_names(one_hot_encoder, cat_cols:list, vocabularies:dict)->list:
+    """Returns the names of the columns created by a fitted one hot encoder of category
+    codes, with the category in place of its code e.g. 'RIAGENDR_1.0'.
+
+    Args:
+        one_hot_encoder (OneHotEncoder): fitted one hot encoder of a categorical pipeline
+        cat_cols (list): categorical columns passed to the pipeline
+        vocabularies (dict): vocabularies of the columns (see categorical_vocabularies)
+
+    Returns:
+        list: names of one hot encoded columns
+    """
+    return ['{}_{}'.format(col, vocabularies[col][int(code)]) \
+        for col, codes in zip(cat_cols, one_hot_encoder.categories_) for code in codes]
+
+def set_one_hot_categories(cat_pipelines:list, cat_cols:list, vocabularies:dict):
+    """Sets the categories of the one hot encoder of categorical pipelines to every code of 
+    the vocabularies, so that training and scoring give the same encoded columns whatever
+    categories the data holds.
+
+    Args:
+        cat_pipelines (list): categorical pipelines (see transformation_pipelines)
+        cat_cols (list): categorical columns passed to the pipelines
+        vocabularies (dict): vocabularies of the columns (see categorical_vocabularies)
+    """
+    categories = [list(range(len(vocabularies[col]))) for col in cat_cols]
+    for cat_pipeline in cat_pipelines:
+        cat_pipeline.set_params(one_hot_encoder__categories=categories)
+
+# 5.2.1 Encode mixed columns and turn them into categorical columns - add a column by adding its
+#       intervals to 'mixed_cols_binning_spec.csv': one row per interval with its bounds (an empty
+#       Upper bound has no limit), which bounds are included in it (Closed: 'both', 'left', 
+#       'right' or 'neither') and its Code. NaN_Policy (the same on every row of a column) says
+#       what values in no interval (e.g. 7777 Refused, 9999 Don't know) become: 'missing' (NaN, 
+#       imputed by the pipelines), 'error' (raise a ValueError) or a number (that code). Values
+#       missing from the data stay missing
+mixed_cols_nan_policies = ['missing', 'error']
+
+@lru_cache(maxsize=None)
+def mixed_cols_binning_spec()->dict:
+    """Returns the intervals, codes and NaN policy of each mixed column from 
+    'mixed_cols_binning_spec.csv'. Computed on first use and cached.
+
+    Returns:
+        dict: dict with one df of intervals (Lower, Upper, Closed, Code, NaN_Policy) per mixed column
+    """
+    spec_df = pd.read_csv(os.path.join(root_loc, 'mixed_cols_binning_spec.csv'), dtype={'NaN_Policy': str})
+    spec_df['Upper'] = spec_df['Upper'].fillna(np.inf)
+    binning_spec = {col: col_spec_df.reset_index(drop=True) for col, col_spec_df in\
+        spec_df.groupby('Feature_Col_Name', sort=False)}
+    for col, intervals in binning_spec.items():
+        nan_policies = list(intervals['NaN_Policy'].unique())
+        is_valid = (len(nan_policies) == 1) and ((nan_policies[0] in mixed_cols_nan_policies) or\
+            not np.isnan(pd.to_numeric(nan_policies[0], errors='coerce')))
+        if not is_valid:
+            raise ValueError('{} needs one NaN_Policy in mixed_cols_binning_spec.csv ({} or a code), '\
+                'found {}'.format(col, mixed_cols_nan_policies, list(nan_policies)))
+    return binning_spec
+
+def binned_col_values(values:pd.Series, intervals:pd.DataFrame, default:float=np.nan)->np.ndarray:
+    """Returns the code of the interval each value falls in, for all values at once.
+
+    Args:
+        values (pd.Series): values of a mixed column
+        intervals (pd.DataFrame): intervals (Lower, Upper, Closed, Code) of the column
+        default (float, optional): code of values in no interval. Defaults to np.nan.
+
+    Returns:
+        np.ndarray: code of each value (NaN if the value is missing)
+    """
+    values = values.to_numpy(dtype=float, na_value=np.nan)
+    conditions = []
+    for lower, upper, closed in zip(intervals['Lower'], intervals['Upper'], intervals['Closed']):
+        above_lower = (values >= lower) if closed in ['both', 'left'] else (values > lower)
+        below_upper = (values <= upper) if closed in ['both', 'right'] else (values < upper)
+        conditions.append(above_lower & below_upper)
+    codes = np.select(conditions, intervals['Code'].to_numpy(dtype=float), default=default)
+    return np.where(np.isnan(values), np.nan, codes)
+
 def mixed_cols_to_cat_cols(df:pd.DataFrame, mixed_cols:list)->pd.DataFrame:
     """Returns a dataframe after handling the columns with a mix of both continuous
     and categorical data. They will be transformed into columns with just categorical data
-    depending on the ranges of the column values.
+    depending on the ranges of the column values, as given in 'mixed_cols_binning_spec.csv'.
     e.g. if a value within the range 0-21 is stored as the value itself but every value 
          greater than 21, it encoded as 5555, the new column will store only 3 encoded values:
          0-10 => encoded as -1, 11-21 => encoded as 0, 21+ => encoded as 1.
@@ -900,218 +2016,102 @@ def mixed_cols_to_cat_cols(df:pd.DataFrame, mixed_cols:list)->pd.DataFrame:
     Returns:
         pd.DataFrame: dataframe with only continuous and categorical columns.
     """
-    i = 0
-    while i in range(len(mixed_cols)):
-        mixed_col = mixed_cols[i]
-        if mixed_col == 'PAD680':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 400):
-                    encoded_col_vals.append(-1)
-                elif (401 <= val and val <= 800):
-                    encoded_col_vals.append(0)
-                elif (801 <= val and val <= 1200):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'ALQ120Q':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 120):
-                    encoded_col_vals.append(-1)
-                elif (121 <= val and val <= 241):
-                    encoded_col_vals.append(0)
-                elif (242 <= val and val <= 365):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'SMD030':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (6 <= val and val <= 79):
-                    encoded_col_vals.append(-1)
-                elif (val == 0):
-                    encoded_col_vals.append(0)
-                elif (80 <= val):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'OCQ180':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 40):
-                    encoded_col_vals.append(-1)
-                elif (41 <= val and val <= 80):
-                    encoded_col_vals.append(0)
-                elif (81 <= val and val <= 120):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col in ['HSQ470','HSQ480','HSQ490']:
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 10):
-                    encoded_col_vals.append(-1)
-                elif (11 <= val and val <= 20):
-                    encoded_col_vals.append(0)
-                elif (21 <= val and val <= 30):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'INDFMMPI':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 2.5):
-                    encoded_col_vals.append(-1)
-                elif (2.5 < val and val <= 5):
-                    encoded_col_vals.append(0)
-                elif (5 < val):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'SLD010H':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (2 <= val and val <= 6):
-                    encoded_col_vals.append(-1)
-                elif (7 <= val and val <= 11):
-                    encoded_col_vals.append(0)
-                elif (12 <= val):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'DMDHRAGE':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (18 <= val and val <= 45):
-                    encoded_col_vals.append(-1)
-                elif (46 <= val and val <= 79):
-                    encoded_col_vals.append(0)
-                elif (80 <= val):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col in ['DBD895','DBD900']:
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 10):
-                    encoded_col_vals.append(-1)
-                elif (11 <= val and val <= 20):
-                    encoded_col_vals.append(0)
-                elif (21 <= val):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'DBD905':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 50):
-                    encoded_col_vals.append(-1)
-                elif (51 <= val and val <= 100):
-                    encoded_col_vals.append(0)
-                elif (101 <= val <= 150):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
-        elif mixed_col == 'DBD910':
-            encoded_col_vals = []
-            col_values = list(df[mixed_col])
-            for val in col_values:
-                if (0 <= val and val <= 60):
-                    encoded_col_vals.append(-1)
-                elif (61 <= val and val <= 120):
-                    encoded_col_vals.append(0)
-                elif (121 <= val <= 180):
-                    encoded_col_vals.append(1)
-                else:
-                    encoded_col_vals.append(np.NaN)
-            df[mixed_col] = encoded_col_vals
-            i += 1
+    binning_spec = mixed_cols_binning_spec()
+    cols_without_spec = [mixed_col for mixed_col in mixed_cols if mixed_col not in binning_spec]
+    if cols_without_spec != []:
+        raise ValueError('No intervals in mixed_cols_binning_spec.csv for {}'.format(cols_without_spec))
+    for mixed_col in mixed_cols:
+        intervals = binning_spec[mixed_col]
+        nan_policy = intervals['NaN_Policy'][0]
+        default = np.nan if nan_policy in mixed_cols_nan_policies else float(nan_policy)
+        codes = binned_col_values(df[mixed_col], intervals, default)
+        if nan_policy == 'error':
+            values = df[mixed_col].to_numpy(dtype=float, na_value=np.nan)
+            values_in_no_interval = values[~np.isnan(values) & np.isnan(codes)]
+            if len(values_in_no_interval) > 0:
+                raise ValueError('Values of {} in no interval of mixed_cols_binning_spec.csv: {}'.format(\
+                    mixed_col, sorted(set(values_in_no_interval.tolist()))))
+        df[mixed_col] = codes
     return df
 
 # 6. Create Transformation Pipelines for ML
-# 6.1 Create baseline numerical and categorical pipelines
-from sklearn.pipeline import Pipeline
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import OneHotEncoder
-
-baseline_cont_pipeline = Pipeline([
-    ('imputer', SimpleImputer(strategy="median")),
-    ('std_scaler', StandardScaler()),
-])
-
-baseline_cat_pipeline = Pipeline([
-    ('imputer', SimpleImputer(strategy="most_frequent")),
-    ('one_hot_encoder', OneHotEncoder()),
-])
-
-# 6.2 Create other transformation pipelines to test algorithm - RFC
-from sklearn.impute import KNNImputer
-
-# 6.2.1 Outline continuous and categorical imputers
-knn_imp_cat = KNNImputer(n_neighbors=1)
-knn_imp_cont = KNNImputer(n_neighbors=3)
-
-cont_pipeline1 = Pipeline([
-    ('imputer', SimpleImputer(strategy="median")),
-    ('standard scaler', StandardScaler()),
-])
-
-cat_pipeline1 = Pipeline([
-    ('imputer', knn_imp_cat),
-    ('one_hot_encoder', OneHotEncoder()),
-])
-
-cont_pipeline2 = Pipeline([
-    ('imputer', knn_imp_cont),
-    ('standard scaler', StandardScaler()),
-])
-
-cat_pipeline2 = Pipeline([
-    ('imputer', SimpleImputer(strategy="most_frequent")),
-    ('one_hot_encoder', OneHotEncoder()),
-])
-
-cont_pipeline3 = Pipeline([
-    ('imputer', knn_imp_cont),
-    ('standard scaler', StandardScaler()),
-])
-
-cat_pipeline3 = Pipeline([
-    ('imputer', knn_imp_cat),
-    ('one_hot_encoder', OneHotEncoder()),
-])
+@lru_cache(maxsize=None)
+def transformation_pipelines()->dict:
+    """Returns the continuous and categorical transformation pipelines. sklearn is only
+    imported and the pipelines only created on first use, then cached.
+
+    Returns:
+        dict: dict of pipeline (and imputer) names and objects
+    """
+    # 6.1 Create baseline numerical and categorical pipelines
+    from sklearn.pipeline import Pipeline
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.preprocessing import OneHotEncoder
+    from sklearn.preprocessing import FunctionTransformer
+
+    # categorical columns are pandas Categorical (see convert_cat_cols_to_categorical); the
+    # categorical pipelines impute and encode their codes, with -1 for missing values. The
+    # categories of the one hot encoders are set from the vocabularies (set_one_hot_categories);
+    # a code that is not a category (KNNImputer imputes the mean of a column when a row has no
+    # known values) is encoded as all zeros
+    cat_codes = FunctionTransformer(categorical_codes)
+
+    baseline_cont_pipeline = Pipeline([
+        ('imputer', SimpleImputer(strategy="median")),
+        ('std_scaler', StandardScaler()),
+    ])
+
+    baseline_cat_pipeline = Pipeline([
+        ('codes', cat_codes),
+        ('imputer', SimpleImputer(missing_values=-1, strategy="most_frequent")),
+        ('one_hot_encoder', OneHotEncoder(handle_unknown='ignore')),
+    ])
+
+    # 6.2 Create other transformation pipelines to test algorithm - RFC
+    from sklearn.impute import KNNImputer
+
+    # 6.2.1 Outline continuous and categorical imputers
+    knn_imp_cat = KNNImputer(n_neighbors=1, missing_values=-1)
+    knn_imp_cont = KNNImputer(n_neighbors=3)
+
+    cont_pipeline1 = Pipeline([
+        ('imputer', SimpleImputer(strategy="median")),
+        ('standard scaler', StandardScaler()),
+    ])
+
+    cat_pipeline1 = Pipeline([
+        ('codes', cat_codes),
+        ('imputer', knn_imp_cat),
+        ('one_hot_encoder', OneHotEncoder(handle_unknown='ignore')),
+    ])
+
+    cont_pipeline2 = Pipeline([
+        ('imputer', knn_imp_cont),
+        ('standard scaler', StandardScaler()),
+    ])
+
+    cat_pipeline2 = Pipeline([
+        ('codes', cat_codes),
+        ('imputer', SimpleImputer(missing_values=-1, strategy="most_frequent")),
+        ('one_hot_encoder', OneHotEncoder(handle_unknown='ignore')),
+    ])
+
+    cont_pipeline3 = Pipeline([
+        ('imputer', knn_imp_cont),
+        ('standard scaler', StandardScaler()),
+    ])
+
+    cat_pipeline3 = Pipeline([
+        ('codes', cat_codes),
+        ('imputer', knn_imp_cat),
+        ('one_hot_encoder', OneHotEncoder(handle_unknown='ignore')),
+    ])
+    return {'baseline_cont_pipeline': baseline_cont_pipeline, 'baseline_cat_pipeline': baseline_cat_pipeline,\
+        'knn_imp_cat': knn_imp_cat, 'knn_imp_cont': knn_imp_cont,\
+        'cont_pipeline1': cont_pipeline1, 'cat_pipeline1': cat_pipeline1,\
+        'cont_pipeline2': cont_pipeline2, 'cat_pipeline2': cat_pipeline2,\
+        'cont_pipeline3': cont_pipeline3, 'cat_pipeline3': cat_pipeline3}
 
 # ####################################################################################################
 
@@ -1369,3 +2369,30 @@ def engineer_features(df:pd.DataFrame)->pd.DataFrame:
     df.drop(['KIQ005','KIQ042','KIQ044','KIQ046'], axis=1, inplace=True)
        
     return df
+
+# ####################################################################################################
+
+# 8. Module attributes that are expensive to compute (they read the NHANES data folder or Excel
+#    sheets, or import sklearn) are only computed the first time they are accessed, e.g.
+#    'from implementation_final import all_cat_cols', so importing this module stays cheap
+lazy_module_attributes = {'file_paths': dietary_supplement_file_paths,\
+    **{name: (lambda name=name: columns_analysis()[name]) for name in ['cols_analysis_df',\
+        'all_relevant_cols', 'all_continuous_cols', 'all_cat_cols', 'all_mixed_cols', 'all_object_cols']},\
+    **{name: (lambda name=name: transformation_pipelines()[name]) for name in ['baseline_cont_pipeline',\
+        'baseline_cat_pipeline', 'knn_imp_cat', 'knn_imp_cont', 'cont_pipeline1', 'cat_pipeline1',\
+            'cont_pipeline2', 'cat_pipeline2', 'cont_pipeline3', 'cat_pipeline3']}}
+
+def __getattr__(name:str):
+    """Computes a lazy module attribute on first access and stores it in the module.
+
+    Args:
+        name (str): attribute name
+
+    Returns:
+        value of the attribute
+    """
+    if name in lazy_module_attributes:
+        value = lazy_module_attributes[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -1,5 +1,4 @@
 import pandas as pd
-import numpy as np
 import os
 from pathlib import Path
 root_loc = os.path.abspath(".")
@@ -7,74 +6,100 @@ root_loc = os.path.abspath(".")
 #  Some data files have multiple rows with data on the same patient and need to separate these
 #  files from the rest in order to create one large dataframe for each year bracket.
 
-# 1. Create a text file containing the names of all data files with multiple rows per patient (SEQN)
-years = ['1999-2000','2001-2002','2003-2004','2005-2006','2007-2008','2009-2010',\
-    '2011-2012','2013-2014','2015-2016','2017-2018']
-root_cats = ['Demographics data', 'Dietary data', 'Examination data', \
-    'Laboratory data', 'Questionnaire data']
-
-from implementation_final import locate_files_with_repeated_seqn
-
-# 1.1 Find all files with repeated SEQN and dump to file 'files_with_seqn_repeats.txt'
-all_repeated_files = []
-for root_cat in root_cats:
-    repeated_files_in_root_cat = locate_files_with_repeated_seqn(years, root_cat)
-    for xpt_file in repeated_files_in_root_cat:
-        all_repeated_files.append(xpt_file)
-
-with open("files_with_seqn_repeats.txt", "r") as f:
-    files_with_repeated_seqn = f.read().split('\n')
-
-# 2. Merge data for one year bracket using only data files that contain unique patients (SEQN)
-from implementation_final import merge_data_for_one_year_bracket
-
-for year in years:
-    year_df = merge_data_for_one_year_bracket(root_cats, year, skip_files=files_with_repeated_seqn)
-    year_df.to_pickle("{}_df.pkl".format(year))
-
-# 3. Create "complete" dataframes for each year bracket including prescription and diet data, where 
-# SEQN repeats
-#    In this step, only certain Dietary files' data and Prescription meds data were included (among 
-#    the list of files with repeated SEQN) in the "complete" dataframe
-#    The other files contained data files that were either too large or that seemed "unnecessary"
-#    to include because of their seeminly weak relation to diabetes
-from implementation_final import updated_pres_meds_df, drug_class_names, diet_supp_df, complete_df
-
-for year in years:
-    print('Creating {} prescription medications df.'.format(year))
-    pres_meds_df = updated_pres_meds_df(year, drug_class_names)
-    pres_meds_df.to_pickle("{}_pres_meds_df.pkl".format(year))
-
-for year in years:
-    print('Creating {} dietary supplement df.'.format(year))
-    dietary_supp_df = diet_supp_df(year)
-    dietary_supp_df.to_pickle("{}_dietary_supp_df.pkl".format(year))
-
-from implementation_final import complete_df
-
-for year in years:
-    print('Creating complete {} df.'.format(year))
-    complete_year_df = complete_df(year)
-    complete_year_df.to_pickle("{}_complete_df.pkl".format(year))
-
-# 4. Create a master dataframe containing the first occurrence of each patient
-#    in each year bracket's complete dataframe and then filter the columns by
-#    getting rid of the ones with % NaN values that exceed a certain threshold
-from implementation_final import create_master_df, filtered_columns_df
-
-master_df = create_master_df(years)
-print('Master dataframe created.')
-master_df.to_pickle("master_df.pkl")
-
-# Dataframe for Purely Data-driven Approach: using NaN value threshold = 0.5
-master_df_with_filtered_cols = filtered_columns_df(master_df, 0.5)
-print('Dataframe to use in Data-driven approach created.')
-master_df_with_filtered_cols.to_pickle('master_df_with_filtered_cols_50.0')
-
-# Dataframe for Domain-driven Approach: using NaN value threshold = 0.55
-final_df = filtered_columns_df(master_df, 0.55)
-print('Dataframe to use in Domain-driven approach created.')
-final_df.to_pickle('final_df')
-
-################################################################################################################################################
-#### RUN FILE ONCE ONLY ########################################################################################################################
\ No newline at end of file
+# The process pool used below re-imports this file in its workers, so the
+# pipeline only runs when main.py is executed directly
+if __name__ == '__main__':
+    # 1. Create a text file containing the names of all data files with multiple rows per patient (SEQN)
+    years = ['1999-2000','2001-2002','2003-2004','2005-2006','2007-2008','2009-2010',\
+        '2011-2012','2013-2014','2015-2016','2017-2018']
+    root_cats = ['Demographics data', 'Dietary data', 'Examination data', \
+        'Laboratory data', 'Questionnaire data']
+
+    from implementation_final import locate_files_with_repeated_seqn_in_parallel
+
+    # 1.1 Find all files with repeated SEQN and dump to file 'files_with_seqn_repeats.txt'
+    #     Every (year, root_cat, file) is checked independently across all cores
+    #     Files unchanged since the last run are looked up in the XPT catalog 'xpt_catalog.pkl'
+    all_repeated_files = locate_files_with_repeated_seqn_in_parallel(years, root_cats)
+
+    repeated_files_text = '\n'.join(all_repeated_files)
+    if (not os.path.isfile("files_with_seqn_repeats.txt")) or \
+        (Path("files_with_seqn_repeats.txt").read_text() != repeated_files_text):
+        Path("files_with_seqn_repeats.txt").write_text(repeated_files_text)
+
+    with open("files_with_seqn_repeats.txt", "r") as f:
+        files_with_repeated_seqn = f.read().split('\n')
+
+    # Every dataframe is stored with compacted dtypes (small integer codes, float32 where lossless)
+    from implementation_final import compact_dtypes, cols_analysis_df
+
+    # Every dataframe below is only rebuilt when its input files, parameters or the code that 
+    # builds it changed since it was last stored (the fingerprint is kept in '<file>.build.json')
+    # e.g. editing drug_class_names rebuilds the prescription medications dfs, the complete dfs
+    # and everything built from them, but not the merged year bracket dfs
+    from implementation_final import build_if_stale
+    cols_analysis_file = os.path.join(root_loc, 'new_cols_analysis_df.xlsx')
+
+    # 2. Merge data for one year bracket using only data files that contain unique patients (SEQN)
+    # 3. Create "complete" dataframes for each year bracket including prescription and diet data, where 
+    # SEQN repeats
+    #    In this step, only certain Dietary files' data and Prescription meds data were included (among 
+    #    the list of files with repeated SEQN) in the "complete" dataframe
+    #    The other files contained data files that were either too large or that seemed "unnecessary"
+    #    to include because of their seeminly weak relation to diabetes
+    #    Other files with repeated SEQN are included as per SEQN aggregates, following the specs in
+    #    repeated_seqn_aggregations (e.g. sums, means and counts of the nutrient amounts of the large 
+    #    Dietary Recall files), computed while reading the files in chunks
+    #    The year brackets are independent of each other, so each one is built by its own process;
+    #    the number of processes is capped so that their estimated memory fits in half of the 
+    #    available memory
+    from implementation_final import build_year_brackets_in_parallel, drug_class_names
+
+    complete_df_files = build_year_brackets_in_parallel(years, root_cats, files_with_repeated_seqn,\
+        drug_class_names)
+
+    # 4. Create a master dataframe containing the first occurrence of each patient
+    #    in each year bracket's complete dataframe and then filter the columns by
+    #    getting rid of the ones with % NaN values that exceed a certain threshold
+    from implementation_final import create_master_df, filtered_columns_df
+
+    master_df_file = os.path.join(root_loc, 'master_df.pkl')
+    if build_if_stale(master_df_file,\
+        lambda: compact_dtypes(create_master_df(years), cols_analysis_df),\
+        input_files=[complete_df_files[year] for year in years] + [cols_analysis_file],\
+        params={'years': years},\
+        functions=[create_master_df, compact_dtypes]):
+        print('Master dataframe created.')
+
+    # Missing values of every column of master_df per year bracket, counted once: the columns 
+    # to keep for any threshold are derived from it without reading master_df again
+    from implementation_final import seqn_year_brackets, missingness_profile, year_bracket_df_files
+
+    missingness_profile_file = os.path.join(root_loc, 'master_df_missingness.pkl')
+    if build_if_stale(missingness_profile_file,\
+        lambda: missingness_profile(pd.read_pickle(master_df_file),\
+            seqn_year_brackets(pd.read_pickle(master_df_file)['SEQN'], years)),\
+        input_files=[master_df_file] + [year_bracket_df_files(year)['eligible_seqn'] for year in years],\
+        params={'years': years},\
+        functions=[missingness_profile, seqn_year_brackets]):
+        print('Missingness profile of master dataframe created.')
+
+    # Dataframe for Purely Data-driven Approach: using NaN value threshold = 0.5
+    # (the filtered dataframes keep the compacted dtypes of master_df)
+    if build_if_stale(os.path.join(root_loc, 'master_df_with_filtered_cols_50.0'),\
+        lambda: filtered_columns_df(pd.read_pickle(master_df_file), 0.5,\
+            pd.read_pickle(missingness_profile_file)),\
+        input_files=[master_df_file, missingness_profile_file], params={'threshold': 0.5},\
+        functions=[filtered_columns_df]):
+        print('Dataframe to use in Data-driven approach created.')
+
+    # Dataframe for Domain-driven Approach: using NaN value threshold = 0.55
+    if build_if_stale(os.path.join(root_loc, 'final_df'),\
+        lambda: filtered_columns_df(pd.read_pickle(master_df_file), 0.55,\
+            pd.read_pickle(missingness_profile_file)),\
+        input_files=[master_df_file, missingness_profile_file], params={'threshold': 0.55},\
+        functions=[filtered_columns_df]):
+        print('Dataframe to use in Domain-driven approach created.')
+
+    ################################################################################################################################################
+    #### RE-RUNS ONLY REBUILD STALE DATAFRAMES #####################################################################################################
\ No newline at end of file
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from implementation_final import categorical_vocabularies, convert_cat_cols_to_categorical,\
+    diabetes_class_labels, assign_diabetes_class_labels
+
+
+def test_categorical_diq010_of_1_is_diabetic(tmp_path):
+    df = pd.DataFrame({'LBXGLU': [90.0, np.nan, 110.0, 90.0], 'DIQ010': [1.0, 1.0, 2.0, np.nan]})
+    vocabularies = categorical_vocabularies(df, ['DIQ010'], str(tmp_path / 'vocabularies.json'))
+    df = convert_cat_cols_to_categorical(df, ['DIQ010'], vocabularies)
+    assert isinstance(df['DIQ010'].dtype, pd.CategoricalDtype)
+
+    labels, counts = diabetes_class_labels(df)
+    assert labels.tolist() == [1, 1, 2, 0]
+    assert counts.tolist() == [1, 2, 1]
+    assert assign_diabetes_class_labels(df)['Diabetes_Class_Label'].tolist() == [1, 1, 2, 0]
+
+
+def test_saved_vocabulary_keeps_codes(tmp_path):
+    vocabularies_file = str(tmp_path / 'vocabularies.json')
+    train_df = pd.DataFrame({'RIAGENDR': [2.0, 1.0, np.nan]})
+    vocabularies = categorical_vocabularies(train_df, ['RIAGENDR'], vocabularies_file)
+    assert vocabularies == {'RIAGENDR': ['1.0', '2.0']}
+
+    score_df = pd.DataFrame({'RIAGENDR': [2.0, 3.0]})
+    assert categorical_vocabularies(score_df, ['RIAGENDR'], vocabularies_file) == vocabularies
+    score_df = convert_cat_cols_to_categorical(score_df, ['RIAGENDR'], vocabularies)
+    assert score_df['RIAGENDR'].cat.codes.tolist() == [1, -1]